@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+from typing import Union, Tuple, List
+
+from battery import Protection, Battery
+import utils
+
+
+class AggregateBattery(Battery):
+    """
+    This class combines multiple batteries, which are connected in parallel, to one virtual battery.
+    It does not communicate with a BMS, but collects the data of the single batteries, which are
+    refreshed by their own DbusHelper in the same process. Only the snapshots of the batteries
+    are read, since the batteries are refreshed in their I/O worker threads meanwhile.
+    """
+
+    BATTERYTYPE = "Aggregate"
+
+    def __init__(self, batteries: List[Battery]):
+        self.batteries = batteries
+        super(AggregateBattery, self).__init__("aggregate", 0, None)
+        self.type = self.BATTERYTYPE
+        self.poll_interval = min(battery.poll_interval for battery in batteries)
+
+    def init_values(self):
+        super(AggregateBattery, self).init_values()
+        self.cell_min_voltage = None
+        self.cell_max_voltage = None
+        self.cell_min_desc = None
+        self.cell_max_desc = None
+        self.temp_min = None
+        self.temp_min_id = None
+        self.temp_max = None
+        self.temp_max_id = None
+        self.temp = None
+        self.balancing = 0
+
+    def get_packs(self) -> List[Battery]:
+        """
+        Returns the snapshots of the last published poll of all batteries
+        """
+        return [battery.snapshot for battery in self.batteries]
+
+    def test_connection(self) -> bool:
+        return len(self.batteries) > 0
+
+    def connection_name(self) -> str:
+        return "Aggregate of " + str(len(self.batteries)) + " batteries"
+
+    def get_settings(self) -> bool:
+        packs = self.get_packs()
+        cell_counts = [b.cell_count for b in packs if b.cell_count is not None]
+        if not cell_counts:
+            return False
+
+        # batteries in parallel have the same cell count, the highest is the safe choice
+        self.cell_count = max(cell_counts)
+        self.capacity = self._sum([b.capacity for b in packs])
+        self.max_battery_voltage = self._min([b.max_battery_voltage for b in packs])
+        self.min_battery_voltage = self._max([b.min_battery_voltage for b in packs])
+        self.max_battery_charge_current = self._sum(
+            [b.max_battery_charge_current for b in packs]
+        )
+        self.max_battery_discharge_current = self._sum(
+            [b.max_battery_discharge_current for b in packs]
+        )
+        self.hardware_version = (
+            str(len(self.batteries))
+            + " batteries in parallel ("
+            + ", ".join(b.type for b in packs)
+            + ")"
+        )
+        return True
+
+    def get_online_batteries(self) -> List[Tuple[int, Battery]]:
+        """
+        Returns the pack number (starting from 1) and the battery of all batteries that
+        are online and have data
+        """
+        return [
+            (number, battery)
+            for number, battery in enumerate(self.get_packs(), start=1)
+            if battery.online and battery.voltage is not None
+        ]
+
+    def get_disconnected_pack(self) -> Union[int, None]:
+        """
+        Returns the pack number (starting from 1) of the first battery, that lost the connection
+        to its BMS or was stopped, if charging/discharging has to be blocked then
+        """
+        if not utils.BLOCK_ON_DISCONNECT:
+            return None
+        for number, battery in enumerate(self.get_packs(), start=1):
+            if not battery.online:
+                return number
+        return None
+
+    def refresh_data(self) -> bool:
+        online = self.get_online_batteries()
+        if not online:
+            return False
+
+        batteries = [battery for _, battery in online]
+
+        # voltage is the same on all packs, current and capacity add up
+        self.voltage = sum(b.voltage for b in batteries) / len(batteries)
+        self.current = self._sum([b.current for b in batteries], True)
+        self.capacity = self._sum([b.capacity for b in batteries])
+        self.capacity_remain = self._sum([b.get_capacity_remain() for b in batteries])
+        if self.capacity and self.capacity_remain is not None:
+            self.soc = self.capacity_remain / self.capacity * 100
+        else:
+            socs = [b.soc for b in batteries if b.soc is not None]
+            self.soc = sum(socs) / len(socs) if socs else None
+        self.cycles = self._max([b.cycles for b in batteries])
+        self.total_ah_drawn = self._sum([b.total_ah_drawn for b in batteries])
+
+        # charging/discharging is possible, as long as one pack allows it
+        self.charge_fet = any(b.charge_fet is not False for b in batteries)
+        self.discharge_fet = any(b.discharge_fet is not False for b in batteries)
+        self.balance_fet = any(b.balance_fet for b in batteries)
+        self.balancing = 1 if any(b.get_balancing() for b in batteries) else 0
+
+        # the worst alarm of all packs is the alarm of the aggregate battery, this includes the
+        # packs that are offline or have no data yet, so that no alarm is dropped
+        packs = self.get_packs()
+        self.protection = Protection()
+        for name in vars(self.protection):
+            setattr(
+                self.protection,
+                name,
+                self._max([getattr(b.protection, name) for b in packs]),
+            )
+
+        # min/max cell across all packs, prefixed with the pack number
+        cells_min = [
+            (b.get_min_cell_voltage(), "P" + str(n) + (b.get_min_cell_desc() or ""))
+            for n, b in online
+            if b.get_min_cell_voltage() is not None
+        ]
+        cells_max = [
+            (b.get_max_cell_voltage(), "P" + str(n) + (b.get_max_cell_desc() or ""))
+            for n, b in online
+            if b.get_max_cell_voltage() is not None
+        ]
+        self.cell_min_voltage, self.cell_min_desc = (
+            min(cells_min) if cells_min else (None, None)
+        )
+        self.cell_max_voltage, self.cell_max_desc = (
+            max(cells_max) if cells_max else (None, None)
+        )
+
+        # min/max temperature across all packs, prefixed with the pack number
+        temps_min = [
+            (b.get_min_temp(), "P" + str(n) + " " + str(b.get_min_temp_id()))
+            for n, b in online
+            if b.get_min_temp() is not None
+        ]
+        temps_max = [
+            (b.get_max_temp(), "P" + str(n) + " " + str(b.get_max_temp_id()))
+            for n, b in online
+            if b.get_max_temp() is not None
+        ]
+        self.temp_min, self.temp_min_id = min(temps_min) if temps_min else (None, None)
+        self.temp_max, self.temp_max_id = max(temps_max) if temps_max else (None, None)
+        self.temp = self._max([b.get_temp() for b in batteries])
+        self.temp_mos = self._max([b.get_mos_temp() for b in batteries])
+
+        return True
+
+    def manage_charge_voltage(self) -> None:
+        """
+        The lowest charge voltage of all packs is used, since the packs share the same bus voltage
+        """
+        packs = [
+            (n, b)
+            for n, b in self.get_online_batteries()
+            if b.control_voltage is not None
+        ]
+        if not packs:
+            self.control_voltage = None
+            self.charge_mode = "--"
+            return
+
+        _, battery = min(packs, key=lambda pack: pack[1].control_voltage)
+        self.control_voltage = battery.control_voltage
+        self.charge_mode = battery.charge_mode
+
+    def manage_charge_current(self) -> None:
+        """
+        Parallel packs share the current roughly equally, therefore the most limited pack limits
+        the whole battery. The lowest limit of all packs is multiplied with the number of packs
+        that can take current. Summing up the single limits would overload the most limited pack.
+        If BLOCK_ON_DISCONNECT is set, a pack without BMS connection blocks the whole battery.
+        """
+        disconnected = self.get_disconnected_pack()
+        if disconnected is not None:
+            limitation = "P" + str(disconnected) + ": BMS disconnected"
+            self.control_charge_current = 0
+            self.control_discharge_current = 0
+            self.charge_limitation = limitation
+            self.discharge_limitation = limitation
+            self.control_allow_charge = False
+            self.control_allow_discharge = False
+            return
+
+        online = self.get_online_batteries()
+
+        charging = [
+            (n, b)
+            for n, b in online
+            if b.control_charge_current is not None and b.charge_fet is not False
+        ]
+        if charging:
+            number, battery = min(
+                charging, key=lambda pack: pack[1].control_charge_current
+            )
+            self.control_charge_current = round(
+                battery.control_charge_current * len(charging), 3
+            )
+            self.charge_limitation = (
+                "P" + str(number) + ": " + str(battery.charge_limitation)
+            )
+        else:
+            self.control_charge_current = 0
+            self.charge_limitation = "No pack can be charged"
+
+        self.control_allow_charge = self.control_charge_current > 0
+
+        discharging = [
+            (n, b)
+            for n, b in online
+            if b.control_discharge_current is not None and b.discharge_fet is not False
+        ]
+        if discharging:
+            number, battery = min(
+                discharging, key=lambda pack: pack[1].control_discharge_current
+            )
+            self.control_discharge_current = round(
+                battery.control_discharge_current * len(discharging), 3
+            )
+            self.discharge_limitation = (
+                "P" + str(number) + ": " + str(battery.discharge_limitation)
+            )
+        else:
+            self.control_discharge_current = 0
+            self.discharge_limitation = "No pack can be discharged"
+
+        self.control_allow_discharge = self.control_discharge_current > 0
+
+    def get_min_cell_desc(self) -> Union[str, None]:
+        return self.cell_min_desc
+
+    def get_max_cell_desc(self) -> Union[str, None]:
+        return self.cell_max_desc
+
+    def get_balancing(self) -> int:
+        return self.balancing
+
+    def get_temp(self) -> Union[float, None]:
+        return self.temp
+
+    def get_min_temp(self) -> Union[float, None]:
+        return self.temp_min
+
+    def get_min_temp_id(self) -> Union[str, None]:
+        return self.temp_min_id
+
+    def get_max_temp(self) -> Union[float, None]:
+        return self.temp_max
+
+    def get_max_temp_id(self) -> Union[str, None]:
+        return self.temp_max_id
+
+    def _sum(self, values, ignore_none=False) -> Union[float, None]:
+        """
+        Returns the sum of the values or None, if a value is missing
+        """
+        if ignore_none:
+            values = [v for v in values if v is not None]
+        if not values or None in values:
+            return None
+        return sum(values)
+
+    def _min(self, values) -> Union[float, None]:
+        values = [v for v in values if v is not None]
+        return min(values) if values else None
+
+    def _max(self, values) -> Union[float, None]:
+        values = [v for v in values if v is not None]
+        return max(values) if values else None
@@ -4,8 +4,9 @@ from typing import Union, Tuple, List
 from utils import logger
 import utils
 import logging
-import math
-from time import time
+from array import array
+from copy import copy
+from time import monotonic, time
 from abc import ABC, abstractmethod
 
 
@@ -38,14 +39,262 @@ class Protection(object):
 class Cell:
     """
     This class holds information about a single Cell
+    As soon as it's added to a CellStore, it's a view on the values of the store
     """
 
-    voltage = None
-    balance = None
-    temp = None
-
     def __init__(self, balance):
-        self.balance = balance
+        self.store = None
+        self.index = None
+        self._voltage = None
+        self._balance = balance
+        self._temp = None
+
+    @property
+    def voltage(self) -> Union[float, None]:
+        if self.store is None:
+            return self._voltage
+        return self.store.get_voltage(self.index)
+
+    @voltage.setter
+    def voltage(self, value) -> None:
+        if self.store is None:
+            self._voltage = value
+        else:
+            self.store.set_voltage(self.index, value)
+
+    @property
+    def balance(self) -> Union[bool, None]:
+        if self.store is None:
+            return self._balance
+        return self.store.get_balance(self.index)
+
+    @balance.setter
+    def balance(self, value) -> None:
+        if self.store is None:
+            self._balance = value
+        else:
+            self.store.set_balance(self.index, value)
+
+    @property
+    def temp(self) -> Union[float, None]:
+        if self.store is None:
+            return self._temp
+        return self.store.get_temp(self.index)
+
+    @temp.setter
+    def temp(self, value) -> None:
+        if self.store is None:
+            self._temp = value
+        else:
+            self.store.set_temp(self.index, value)
+
+
+class CellStats:
+    """
+    This class holds the statistics of all cell voltages, which are calculated in one pass
+    """
+
+    def __init__(self):
+        # number of cells with a voltage
+        self.count: int = 0
+        self.min_voltage: float = None
+        self.max_voltage: float = None
+        # index of the cell with the min/max voltage
+        self.min_cell: int = None
+        self.max_cell: int = None
+        self.voltage_sum: float = 0
+        # voltage sum of the lower and upper half of the cells, without the middle cell
+        self.half1_sum: float = 0
+        self.half2_sum: float = 0
+        self.middle_voltage: float = None
+        # number of cells above MAX_CELL_VOLTAGE and the sum of the overvoltages
+        self.over_max_count: int = 0
+        self.over_max_penalty: float = 0
+        self.balancing: int = 0
+
+
+class CellStore:
+    """
+    This class holds the values of all cells in arrays instead of single Cell objects.
+    Drivers can write all values with one call (set_voltages, set_balances, set_temps) or
+    use the Cell views (cells[i].voltage) as before.
+    """
+
+    def __init__(self, cells=()):
+        self.voltages = array("d")
+        self.voltage_valid = array("b")
+        self.temps = array("d")
+        self.temp_valid = array("b")
+        # -1: unknown, 0: not balancing, 1: balancing
+        self.balances = array("b")
+        self.views: List[Cell] = []
+        self.stats: CellStats = None
+        for cell in cells:
+            self.append(cell)
+
+    def __len__(self) -> int:
+        return len(self.views)
+
+    def __iter__(self):
+        return iter(self.views)
+
+    def __getitem__(self, index):
+        return self.views[index]
+
+    def __bool__(self) -> bool:
+        return len(self.views) > 0
+
+    def copy(self) -> "CellStore":
+        """
+        Returns an independent copy of the values, with its own Cell views
+        """
+        store = CellStore()
+        store.voltages = self.voltages[:]
+        store.voltage_valid = self.voltage_valid[:]
+        store.temps = self.temps[:]
+        store.temp_valid = self.temp_valid[:]
+        store.balances = self.balances[:]
+        for index in range(len(self.views)):
+            cell = Cell(None)
+            cell.store = store
+            cell.index = index
+            store.views.append(cell)
+        store.stats = self.stats
+        return store
+
+    def append(self, cell: Cell) -> None:
+        voltage, balance, temp = cell.voltage, cell.balance, cell.temp
+        self.voltages.append(0.0)
+        self.voltage_valid.append(0)
+        self.temps.append(0.0)
+        self.temp_valid.append(0)
+        self.balances.append(-1)
+        cell.store = self
+        cell.index = len(self.views)
+        self.views.append(cell)
+        cell.voltage, cell.balance, cell.temp = voltage, balance, temp
+
+    def remove(self, cell: Cell) -> None:
+        index = self.views.index(cell)
+        voltage, balance, temp = cell.voltage, cell.balance, cell.temp
+        cell.store = None
+        cell.index = None
+        cell.voltage, cell.balance, cell.temp = voltage, balance, temp
+        del self.views[index]
+        for values in (
+            self.voltages,
+            self.voltage_valid,
+            self.temps,
+            self.temp_valid,
+            self.balances,
+        ):
+            del values[index]
+        for i in range(index, len(self.views)):
+            self.views[i].index = i
+        self.stats = None
+
+    def get_voltage(self, index) -> Union[float, None]:
+        return self.voltages[index] if self.voltage_valid[index] else None
+
+    def set_voltage(self, index, value) -> None:
+        if value is None:
+            self.voltage_valid[index] = 0
+        else:
+            self.voltages[index] = value
+            self.voltage_valid[index] = 1
+        self.stats = None
+
+    def set_voltages(self, values, offset=0) -> None:
+        """
+        Sets the voltages of multiple cells at once, starting from the cell at offset
+        """
+        for index, value in enumerate(values, start=offset):
+            if value is None:
+                self.voltage_valid[index] = 0
+            else:
+                self.voltages[index] = value
+                self.voltage_valid[index] = 1
+        self.stats = None
+
+    def get_balance(self, index) -> Union[bool, None]:
+        balance = self.balances[index]
+        return None if balance < 0 else balance == 1
+
+    def set_balance(self, index, value) -> None:
+        self.balances[index] = -1 if value is None else (1 if value else 0)
+        self.stats = None
+
+    def set_balances(self, values, offset=0) -> None:
+        """
+        Sets the balancing state of multiple cells at once, starting from the cell at offset
+        """
+        for index, value in enumerate(values, start=offset):
+            self.balances[index] = -1 if value is None else (1 if value else 0)
+        self.stats = None
+
+    def get_temp(self, index) -> Union[float, None]:
+        return self.temps[index] if self.temp_valid[index] else None
+
+    def set_temp(self, index, value) -> None:
+        if value is None:
+            self.temp_valid[index] = 0
+        else:
+            self.temps[index] = value
+            self.temp_valid[index] = 1
+
+    def set_temps(self, values, offset=0) -> None:
+        """
+        Sets the temperatures of multiple cells at once, starting from the cell at offset
+        """
+        for index, value in enumerate(values, start=offset):
+            self.set_temp(index, value)
+
+    def get_stats(self) -> CellStats:
+        """
+        Returns the statistics of all cells. They are calculated in one pass and cached
+        until a value of the store changes.
+        """
+        if self.stats is not None:
+            return self.stats
+
+        stats = CellStats()
+        max_cell_voltage = utils.MAX_CELL_VOLTAGE
+        length = len(self.views)
+        halfcount = length // 2
+        upper_start = halfcount + length % 2
+        voltages = self.voltages
+        valid = self.voltage_valid
+
+        for i in range(length):
+            if not valid[i]:
+                continue
+            voltage = voltages[i]
+            stats.count += 1
+            if stats.min_voltage is None or voltage < stats.min_voltage:
+                stats.min_voltage = voltage
+                stats.min_cell = i
+            if stats.max_voltage is None or voltage > stats.max_voltage:
+                stats.max_voltage = voltage
+                stats.max_cell = i
+            stats.voltage_sum += voltage
+            if i < halfcount:
+                stats.half1_sum += voltage
+            elif i >= upper_start:
+                stats.half2_sum += voltage
+            else:
+                stats.middle_voltage = voltage
+            if voltage > max_cell_voltage:
+                stats.over_max_count += 1
+                stats.over_max_penalty += voltage - max_cell_voltage - 0.010
+
+        # same as before, a cell with 0 V is not reported as max cell
+        if stats.max_voltage is not None and stats.max_voltage <= 0:
+            stats.max_cell = None
+
+        stats.balancing = 1 if 1 in self.balances else 0
+
+        self.stats = stats
+        return stats
 
 
 class Battery(ABC):
@@ -55,13 +304,23 @@ class Battery(ABC):
     use the individual implementations as type Battery and work with it.
     """
 
+    # Data groups read by refresh_groups() as tuples of the read method name and the refresh
+    # interval in seconds, 0 reads the group on every poll. Slow-changing data like cycles
+    # doesn't need to be requested from the BMS on every poll.
+    REFRESH_GROUPS: Tuple[Tuple[str, float], ...] = ()
+
     def __init__(self, port, baud, address):
         self.port = port
         self.baud_rate = baud
         self.role = "battery"
         self.type = "Generic"
         self.poll_interval = 1000
+        # values of the last poll, which are compared by get_poll_interval()
+        self.poll_last = None
+        self.poll_interval_next = None
         self.online = True
+        # copy of the values of the last published poll, see get_snapshot()
+        self.snapshot: Battery = None
         self.hardware_version = None
         self.cell_count = None
         # max battery charge/discharge current
@@ -99,7 +358,8 @@ class Battery(ABC):
         self.temp3 = None
         self.temp4 = None
         self.temp_mos = None
-        self.cells: List[Cell] = []
+        self.cells: CellStore = CellStore()
+        self.cell_stats: CellStats = None
         self.control_charging = None
         self.control_voltage = None
         self.allow_max_voltage = True
@@ -117,6 +377,22 @@ class Battery(ABC):
         self.control_charge_current = None
         self.control_allow_charge = None
         self.control_allow_discharge = None
+        # monotonic time, when a refresh group has to be read next
+        self.refresh_due = {}
+        # None, if no reply of this refresh was checked by is_frame_unchanged(), else
+        # False, if all checked replies were the same as in the last refresh
+        self.refresh_changed = None
+        # the values were reset, therefore the next replies have to be parsed again
+        utils.clear_frame_digests(self.port)
+
+    @property
+    def cells(self) -> CellStore:
+        return self._cells
+
+    @cells.setter
+    def cells(self, cells) -> None:
+        # lists of Cell objects assigned by the drivers are converted to a CellStore
+        self._cells = cells if isinstance(cells, CellStore) else CellStore(cells)
 
     @abstractmethod
     def test_connection(self) -> bool:
@@ -160,6 +436,48 @@ class Battery(ABC):
         """
         return False
 
+    def is_frame_unchanged(self, command, data) -> bool:
+        """
+        Returns True, if the valid reply to command is the same as the last one, that was saved
+        with frame_parsed(). The driver can skip parsing it then. If all checked replies of a
+        refresh were unchanged, the DbusHelper also skips publishing the battery values, see
+        DbusHelper.publish_battery().
+
+        :return:  true if the reply can be skipped
+        """
+        unchanged = utils.is_frame_unchanged(self.port, command, data)
+        if not unchanged:
+            self.refresh_changed = True
+        elif self.refresh_changed is None:
+            self.refresh_changed = False
+        return unchanged
+
+    def frame_parsed(self, command, data) -> None:
+        """
+        Has to be called by the driver, after a reply checked by is_frame_unchanged() was parsed
+        completely, so that the next identical reply can be skipped
+        """
+        utils.save_frame_digest(self.port, command, data)
+
+    def refresh_groups(self) -> bool:
+        """
+        Reads the groups of REFRESH_GROUPS that are due, in the declared order.
+        A failed group is read again on the next poll and stops reading the following groups.
+        Drivers that declare REFRESH_GROUPS can return this from refresh_data().
+
+        :return:  false when fail, true if successful
+        """
+        now = monotonic()
+        # half a poll interval tolerance, so that a group is not delayed by a whole poll
+        tolerance = self.poll_interval / 2000
+        for method, interval in self.REFRESH_GROUPS:
+            if now < self.refresh_due.get(method, 0):
+                continue
+            if not getattr(self, method)():
+                return False
+            self.refresh_due[method] = now + interval - tolerance
+        return True
+
     def to_temp(self, sensor: int, value: float) -> None:
         """
         Keep the temp value between -20 and 100 to handle sensor issues or no data.
@@ -208,16 +526,13 @@ class Battery(ABC):
         try:
             if utils.CVCM_ENABLE:
                 # calculate battery sum
-                for i in range(self.cell_count):
-                    voltage = self.get_cell_voltage(i)
-                    if voltage:
-                        voltageSum += voltage
+                stats = self.get_cell_stats()
+                voltageSum = stats.voltage_sum
 
-                        # calculate penalty sum to prevent single cell overcharge by using current cell voltage
-                        if voltage > utils.MAX_CELL_VOLTAGE:
-                            # foundHighCellVoltage: reset to False is not needed, since it is recalculated every second
-                            foundHighCellVoltage = True
-                            penaltySum += voltage - utils.MAX_CELL_VOLTAGE - 0.010
+                # calculate penalty sum to prevent single cell overcharge by using current cell voltage
+                # foundHighCellVoltage: reset to False is not needed, since it is recalculated every second
+                foundHighCellVoltage = stats.over_max_count > 0
+                penaltySum = stats.over_max_penalty
 
                 voltageDiff = self.get_max_cell_voltage() - self.get_min_cell_voltage()
 
@@ -504,34 +819,16 @@ class Battery(ABC):
 
     def calcMaxChargeCurrentReferringToCellVoltage(self) -> float:
         try:
-            if utils.LINEAR_LIMITATION_ENABLE:
-                return utils.calcLinearRelationship(
-                    self.get_max_cell_voltage(),
-                    utils.CELL_VOLTAGES_WHILE_CHARGING,
-                    utils.MAX_CHARGE_CURRENT_CV,
-                )
-            return utils.calcStepRelationship(
-                self.get_max_cell_voltage(),
-                utils.CELL_VOLTAGES_WHILE_CHARGING,
-                utils.MAX_CHARGE_CURRENT_CV,
-                False,
+            return utils.MAX_CHARGE_CURRENT_CV_CURVE.get(
+                self.get_max_cell_voltage(), False
             )
         except Exception:
             return self.max_battery_charge_current
 
     def calcMaxDischargeCurrentReferringToCellVoltage(self) -> float:
         try:
-            if utils.LINEAR_LIMITATION_ENABLE:
-                return utils.calcLinearRelationship(
-                    self.get_min_cell_voltage(),
-                    utils.CELL_VOLTAGES_WHILE_DISCHARGING,
-                    utils.MAX_DISCHARGE_CURRENT_CV,
-                )
-            return utils.calcStepRelationship(
-                self.get_min_cell_voltage(),
-                utils.CELL_VOLTAGES_WHILE_DISCHARGING,
-                utils.MAX_DISCHARGE_CURRENT_CV,
-                True,
+            return utils.MAX_DISCHARGE_CURRENT_CV_CURVE.get(
+                self.get_min_cell_voltage(), True
             )
         except Exception:
             return self.max_battery_charge_current
@@ -540,126 +837,83 @@ class Battery(ABC):
         if self.get_max_temp() is None:
             return self.max_battery_charge_current
 
-        temps = {0: self.get_max_temp(), 1: self.get_min_temp()}
-
-        for key, currentMaxTemperature in temps.items():
-            if utils.LINEAR_LIMITATION_ENABLE:
-                temps[key] = utils.calcLinearRelationship(
-                    currentMaxTemperature,
-                    utils.TEMPERATURE_LIMITS_WHILE_CHARGING,
-                    utils.MAX_CHARGE_CURRENT_T,
-                )
-            else:
-                temps[key] = utils.calcStepRelationship(
-                    currentMaxTemperature,
-                    utils.TEMPERATURE_LIMITS_WHILE_CHARGING,
-                    utils.MAX_CHARGE_CURRENT_T,
-                    False,
-                )
-
-        return min(temps[0], temps[1])
+        return min(
+            utils.MAX_CHARGE_CURRENT_T_CURVE.get(self.get_max_temp(), False),
+            utils.MAX_CHARGE_CURRENT_T_CURVE.get(self.get_min_temp(), False),
+        )
 
     def calcMaxDischargeCurrentReferringToTemperature(self) -> float:
         if self.get_max_temp() is None:
             return self.max_battery_discharge_current
 
-        temps = {0: self.get_max_temp(), 1: self.get_min_temp()}
-
-        for key, currentMaxTemperature in temps.items():
-            if utils.LINEAR_LIMITATION_ENABLE:
-                temps[key] = utils.calcLinearRelationship(
-                    currentMaxTemperature,
-                    utils.TEMPERATURE_LIMITS_WHILE_DISCHARGING,
-                    utils.MAX_DISCHARGE_CURRENT_T,
-                )
-            else:
-                temps[key] = utils.calcStepRelationship(
-                    currentMaxTemperature,
-                    utils.TEMPERATURE_LIMITS_WHILE_DISCHARGING,
-                    utils.MAX_DISCHARGE_CURRENT_T,
-                    True,
-                )
-
-        return min(temps[0], temps[1])
+        return min(
+            utils.MAX_DISCHARGE_CURRENT_T_CURVE.get(self.get_max_temp(), True),
+            utils.MAX_DISCHARGE_CURRENT_T_CURVE.get(self.get_min_temp(), True),
+        )
 
     def calcMaxChargeCurrentReferringToSoc(self) -> float:
         try:
-            # Create value list. Will more this to the settings object
-            SOC_WHILE_CHARGING = [
-                100,
-                utils.CC_SOC_LIMIT1,
-                utils.CC_SOC_LIMIT2,
-                utils.CC_SOC_LIMIT3,
-            ]
-            MAX_CHARGE_CURRENT_SOC = [
-                utils.CC_CURRENT_LIMIT1,
-                utils.CC_CURRENT_LIMIT2,
-                utils.CC_CURRENT_LIMIT3,
-                utils.MAX_BATTERY_CHARGE_CURRENT,
-            ]
-            if utils.LINEAR_LIMITATION_ENABLE:
-                return utils.calcLinearRelationship(
-                    self.soc, SOC_WHILE_CHARGING, MAX_CHARGE_CURRENT_SOC
-                )
-            return utils.calcStepRelationship(
-                self.soc, SOC_WHILE_CHARGING, MAX_CHARGE_CURRENT_SOC, True
-            )
+            return utils.MAX_CHARGE_CURRENT_SOC_CURVE.get(self.soc, True)
         except Exception:
             return self.max_battery_charge_current
 
     def calcMaxDischargeCurrentReferringToSoc(self) -> float:
         try:
-            # Create value list. Will more this to the settings object
-            SOC_WHILE_DISCHARGING = [
-                utils.DC_SOC_LIMIT3,
-                utils.DC_SOC_LIMIT2,
-                utils.DC_SOC_LIMIT1,
-            ]
-            MAX_DISCHARGE_CURRENT_SOC = [
-                utils.MAX_BATTERY_DISCHARGE_CURRENT,
-                utils.DC_CURRENT_LIMIT3,
-                utils.DC_CURRENT_LIMIT2,
-                utils.DC_CURRENT_LIMIT1,
-            ]
-            if utils.LINEAR_LIMITATION_ENABLE:
-                return utils.calcLinearRelationship(
-                    self.soc, SOC_WHILE_DISCHARGING, MAX_DISCHARGE_CURRENT_SOC
-                )
-            return utils.calcStepRelationship(
-                self.soc, SOC_WHILE_DISCHARGING, MAX_DISCHARGE_CURRENT_SOC, True
-            )
+            return utils.MAX_DISCHARGE_CURRENT_SOC_CURVE.get(self.soc, True)
         except Exception:
             return self.max_battery_charge_current
 
-    def get_min_cell(self) -> int:
-        min_voltage = 9999
-        min_cell = None
+    def calc_cell_stats(self) -> CellStats:
+        """
+        Returns the cell statistics of the cell store, including the min/max values
+        that some BMS (e.g. Daly, Ant) report themselves
+        """
+        stats = copy(self.cells.get_stats())
+
+        if getattr(self, "cell_min_voltage", None) is not None:
+            stats.min_voltage = self.cell_min_voltage
+        if getattr(self, "cell_max_voltage", None) is not None:
+            stats.max_voltage = self.cell_max_voltage
         if len(self.cells) == 0 and hasattr(self, "cell_min_no"):
-            return self.cell_min_no
+            stats.min_cell = self.cell_min_no
+        if len(self.cells) == 0 and hasattr(self, "cell_max_no"):
+            stats.max_cell = self.cell_max_no
 
-        for c in range(min(len(self.cells), self.cell_count)):
-            if (
-                self.cells[c].voltage is not None
-                and min_voltage > self.cells[c].voltage
-            ):
-                min_voltage = self.cells[c].voltage
-                min_cell = c
-        return min_cell
+        return stats
 
-    def get_max_cell(self) -> int:
-        max_voltage = 0
-        max_cell = None
-        if len(self.cells) == 0 and hasattr(self, "cell_max_no"):
-            return self.cell_max_no
+    def get_snapshot(self) -> "Battery":
+        """
+        Returns a copy of the battery values, that is not changed by the next refresh.
+        It's taken by the DbusHelper in the main loop after each poll, so that other batteries
+        (e.g. the aggregate battery) can read the values while the I/O worker refreshes the battery.
+        """
+        snapshot = copy(self)
+        snapshot.snapshot = None
+        snapshot.cells = self.cells.copy()
+        snapshot.protection = copy(self.protection)
+        return snapshot
 
-        for c in range(min(len(self.cells), self.cell_count)):
-            if (
-                self.cells[c].voltage is not None
-                and max_voltage < self.cells[c].voltage
-            ):
-                max_voltage = self.cells[c].voltage
-                max_cell = c
-        return max_cell
+    def update_cell_stats(self) -> None:
+        """
+        Takes a snapshot of the cell statistics, which is used by all consumers until the next refresh.
+        It is called by DbusHelper.publish_battery() right after refresh_data()
+        """
+        self.cell_stats = self.calc_cell_stats()
+
+    def get_cell_stats(self) -> CellStats:
+        """
+        Returns the snapshot of the cell statistics. While the data is refreshed, there is
+        no snapshot and the current values are used.
+        """
+        if self.cell_stats is not None:
+            return self.cell_stats
+        return self.calc_cell_stats()
+
+    def get_min_cell(self) -> int:
+        return self.get_cell_stats().min_cell
+
+    def get_max_cell(self) -> int:
+        return self.get_cell_stats().max_cell
 
     def get_min_cell_desc(self) -> Union[str, None]:
         cell_no = self.get_min_cell()
@@ -741,32 +995,10 @@ class Battery(ABC):
         return tmp.rstrip()
 
     def get_min_cell_voltage(self) -> Union[float, None]:
-        min_voltage = None
-        if hasattr(self, "cell_min_voltage"):
-            min_voltage = self.cell_min_voltage
-
-        if min_voltage is None:
-            try:
-                min_voltage = min(
-                    c.voltage for c in self.cells if c.voltage is not None
-                )
-            except ValueError:
-                pass
-        return min_voltage
+        return self.get_cell_stats().min_voltage
 
     def get_max_cell_voltage(self) -> Union[float, None]:
-        max_voltage = None
-        if hasattr(self, "cell_max_voltage"):
-            max_voltage = self.cell_max_voltage
-
-        if max_voltage is None:
-            try:
-                max_voltage = max(
-                    c.voltage for c in self.cells if c.voltage is not None
-                )
-            except ValueError:
-                pass
-        return max_voltage
+        return self.get_cell_stats().max_voltage
 
     def get_midvoltage(self) -> Tuple[Union[float, None], Union[float, None]]:
         """
@@ -784,27 +1016,12 @@ class Battery(ABC):
         ):
             return None, None
 
-        halfcount = int(math.floor(self.cell_count / 2))
-        uneven_cells_offset = self.cell_count % 2
-        half1voltage = 0
-        half2voltage = 0
+        stats = self.get_cell_stats()
+        half1voltage = stats.half1_sum
+        half2voltage = stats.half2_sum
 
         try:
-            half1voltage = sum(
-                cell.voltage
-                for cell in self.cells[:halfcount]
-                if cell.voltage is not None
-            )
-            half2voltage = sum(
-                cell.voltage
-                for cell in self.cells[halfcount + uneven_cells_offset :]
-                if cell.voltage is not None
-            )
-        except ValueError:
-            pass
-
-        try:
-            extra = 0 if self.cell_count % 2 == 0 else self.cells[halfcount].voltage / 2
+            extra = 0 if self.cell_count % 2 == 0 else stats.middle_voltage / 2
             # get the midpoint of the battery
             midpoint = half1voltage + extra
             return (
@@ -813,14 +1030,11 @@ class Battery(ABC):
                     (half2voltage - half1voltage) / (half2voltage + half1voltage) * 100
                 ),
             )
-        except ValueError:
+        except (ValueError, TypeError, ZeroDivisionError):
             return None, None
 
     def get_balancing(self) -> int:
-        for c in range(min(len(self.cells), self.cell_count)):
-            if self.cells[c].balance is not None and self.cells[c].balance:
-                return 1
-        return 0
+        return self.get_cell_stats().balancing
 
     def get_temperatures(self) -> Union[List[float], None]:
         temperatures = [self.temp1, self.temp2, self.temp3, self.temp4]
@@ -935,13 +1149,60 @@ class Battery(ABC):
             return False
 
         cell_res = ""
-        cell_counter = 1
-        for c in self.cells:
-            cell_res += "[{0}]{1}V ".format(cell_counter, c.voltage)
-            cell_counter = cell_counter + 1
+        for c in range(len(self.cells)):
+            cell_res += "[{0}]{1}V ".format(c + 1, self.cells.get_voltage(c))
         logger.debug("Cells:" + cell_res)
         return True
 
+    def get_poll_interval(self) -> int:
+        """
+        Returns the interval in ms until the next poll. Without POLL_INTERVAL_ADAPTIVE this is the
+        poll_interval of the driver. Else the battery is polled fast, while it's changing or an alarm
+        is active, and the interval is doubled on every idle poll up to POLL_INTERVAL_MAX.
+        """
+        if not utils.POLL_INTERVAL_ADAPTIVE:
+            return self.poll_interval
+
+        fast = max(utils.POLL_INTERVAL_MIN, self.poll_interval)
+        slow = max(utils.POLL_INTERVAL_MAX, fast)
+
+        stats = self.get_cell_stats()
+        cell_diff = (
+            stats.max_voltage - stats.min_voltage
+            if stats.max_voltage is not None and stats.min_voltage is not None
+            else None
+        )
+        current = self.current if self.current is not None else 0
+        last = self.poll_last
+        self.poll_last = (
+            current,
+            cell_diff,
+            self.control_charge_current,
+            self.control_discharge_current,
+        )
+
+        # the cell voltages only move towards their limits, while current is flowing, therefore
+        # an idle full or empty battery is polled slowly as well
+        active = (
+            last is None
+            or abs(current) >= utils.POLL_IDLE_CURRENT
+            or abs(current - last[0]) >= utils.POLL_IDLE_CURRENT
+            or self.poll_last[2:] != last[2:]
+            or (
+                cell_diff is not None
+                and last[1] is not None
+                and abs(cell_diff - last[1]) >= 0.01
+            )
+            # any warning or alarm
+            or any(value for value in vars(self.protection).values())
+        )
+
+        if active or self.poll_interval_next is None:
+            self.poll_interval_next = fast
+        else:
+            self.poll_interval_next = min(self.poll_interval_next * 2, slow)
+        return self.poll_interval_next
+
     def log_settings(self) -> None:
         cell_counter = len(self.cells)
         logger.info(f"Battery {self.type} connected to dbus from {self.port}")
@@ -64,6 +64,10 @@ class BatteryTemplate(Battery):
         # call all functions that will refresh the battery data.
         # This will be called for every iteration (1 second)
         # Return True if success, False for failure
+        # Data that changes slowly can be declared in REFRESH_GROUPS with its own refresh interval
+        # and read with "return self.refresh_groups()", see battery.py
+        # A valid reply that is the same as the last one doesn't need to be parsed again,
+        # see Battery.is_frame_unchanged() and Battery.frame_parsed()
         result = self.read_soc_data()
 
         return result
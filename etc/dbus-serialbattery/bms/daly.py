@@ -1,13 +1,72 @@
 # -*- coding: utf-8 -*-
+from typing import Dict, List
 from battery import Battery, Cell
-from utils import open_serial_port, logger
+from utils import (
+    read_serial_bytes,
+    record_transport,
+    record_transport_event,
+    serial_port_session,
+    serial_wire_time,
+    SERIAL_REPLY_TIMEOUT,
+    logger,
+)
 import utils
 from struct import unpack_from, pack_into
-from time import sleep, time
+from time import monotonic, sleep
 from datetime import datetime
 from re import sub
 
 
+class DalySentenceParser:
+    """
+    Streaming parser for the 13 byte sentences of the Daly BMS.
+    The received bytes can be fed in chunks of any size. Valid sentences are collected by
+    command, on a wrong header or checksum the parser resynchronises on the next 0xA5.
+    """
+
+    SENTENCE_SIZE = 13
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.replies: Dict[int, List[bytearray]] = {}
+        # time.monotonic(), when the last sentence of a command was received
+        self.received_at: Dict[int, float] = {}
+        self.errors = 0
+
+    def feed(self, data) -> None:
+        buffer = self.buffer
+        buffer += data
+        start = 0
+        while True:
+            start = buffer.find(0xA5, start)
+            if start < 0:
+                start = len(buffer)
+                break
+            if len(buffer) - start < self.SENTENCE_SIZE:
+                break
+
+            # [StartFlag=A5][Address=01][Command][DataLength=8][8 data bytes][checksum]
+            end = start + self.SENTENCE_SIZE
+            if (
+                buffer[start + 1] == 1
+                and buffer[start + 3] == 8
+                and sum(buffer[start : end - 1]) & 0xFF == buffer[end - 1]
+            ):
+                self.replies.setdefault(buffer[start + 2], []).append(
+                    buffer[start + 4 : end - 1]
+                )
+                self.received_at[buffer[start + 2]] = monotonic()
+                start = end
+            else:
+                self.errors += 1
+                start += 1
+
+        del buffer[:start]
+
+    def received(self, command: int) -> int:
+        return len(self.replies.get(command, ()))
+
+
 class Daly(Battery):
     def __init__(self, port, baud, address):
         super(Daly, self).__init__(port, baud, address)
@@ -24,6 +83,12 @@ class Daly(Battery):
         self.reset_soc = 0
         self.soc_to_set = None
         self.runtime = 0  # TROUBLESHOOTING for no reply errors
+        # minimum time between two commands, learned while polling
+        self.command_gap = self.COMMAND_GAP_START
+        self.last_write = 0
+        # replies received in one go by request_pipelined(), consumed by request_data()
+        self.prefetched: Dict[int, bytearray] = {}
+        self.pipelined = set()
         self.trigger_force_disable_discharge = None
         self.trigger_force_disable_charge = None
         self.cells_volts_data_lastreadbad = False
@@ -51,6 +116,14 @@ class Daly(Battery):
     LENGTH_POS = 3
     CURRENT_ZERO_CONSTANT = 30000
     TEMP_ZERO_CONSTANT = 40
+    # wait between two commands, else the Daly is not ready and throws a lot of no reply errors
+    # the gap is decreased while all replies are received and increased on missing replies,
+    # but never below the 20ms the Daly is known to handle, else it oscillates around
+    # the gap where replies start to get lost
+    COMMAND_GAP_START = 0.020
+    COMMAND_GAP_MIN = 0.020
+    COMMAND_GAP_MAX = 0.050
+    COMMAND_GAP_STEP = 0.002
 
     def test_connection(self):
         # call a function that will connect to the battery, send a command and retrieve the result.
@@ -58,7 +131,7 @@ class Daly(Battery):
         # Return True if success, False for failure
         result = False
         try:
-            with open_serial_port(self.port, self.baud_rate) as ser:
+            with serial_port_session(self.port, self.baud_rate) as ser:
                 result = self.read_status_data(ser)
                 # get first data to show in startup log, only if result is true
                 if result:
@@ -77,7 +150,7 @@ class Daly(Battery):
 
     def get_settings(self):
         self.capacity = utils.BATTERY_CAPACITY
-        with open_serial_port(self.port, self.baud_rate) as ser:
+        with serial_port_session(self.port, self.baud_rate) as ser:
             self.read_capacity(ser)
             self.read_production_date(ser)
 
@@ -87,100 +160,64 @@ class Daly(Battery):
 
     def refresh_data(self):
         result = False
+        time_start = monotonic()
 
-        # Open serial port to be used for all data reads instead of opening multiple times
+        # Use the shared serial port for all data reads instead of opening it multiple times
         try:
-            with open_serial_port(self.port, self.baud_rate) as ser:
+            with serial_port_session(self.port, self.baud_rate) as ser:
+                # request all data at once, the single reads below only repeat missing replies
+                self.request_pipelined(ser, self.get_refresh_requests())
+
                 result = self.read_soc_data(ser)
                 self.reset_soc = self.soc if self.soc else 0
-                if self.runtime > 0.200:  # TROUBLESHOOTING for no reply errors
-                    logger.info(
-                        "  |- refresh_data: read_soc_data - result: "
-                        + str(result)
-                        + " - runtime: "
-                        + str(f"{self.runtime:.1f}")
-                        + "s"
-                    )
-
                 result = self.read_fed_data(ser) and result
-                if self.runtime > 0.200:  # TROUBLESHOOTING for no reply errors
-                    logger.info(
-                        "  |- refresh_data: read_fed_data - result: "
-                        + str(result)
-                        + " - runtime: "
-                        + str(f"{self.runtime:.1f}")
-                        + "s"
-                    )
-
                 result = self.read_cell_voltage_range_data(ser) and result
-                if self.runtime > 0.200:  # TROUBLESHOOTING for no reply errors
-                    logger.info(
-                        "  |- refresh_data: read_cell_voltage_range_data - result: "
-                        + str(result)
-                        + " - runtime: "
-                        + str(f"{self.runtime:.1f}")
-                        + "s"
-                    )
-
                 self.write_soc_and_datetime(ser)
-                if self.runtime > 0.200:  # TROUBLESHOOTING for no reply errors
-                    logger.info(
-                        "  |- refresh_data: write_soc_and_datetime - result: "
-                        + str(result)
-                        + " - runtime: "
-                        + str(f"{self.runtime:.1f}")
-                        + "s"
-                    )
-
                 result = self.read_alarm_data(ser) and result
-                if self.runtime > 0.200:  # TROUBLESHOOTING for no reply errors
-                    logger.info(
-                        "  |- refresh_data: read_alarm_data - result: "
-                        + str(result)
-                        + " - runtime: "
-                        + str(f"{self.runtime:.1f}")
-                        + "s"
-                    )
-
                 result = self.read_temperature_range_data(ser) and result
-                if self.runtime > 0.200:  # TROUBLESHOOTING for no reply errors
-                    logger.info(
-                        "  |- refresh_data: read_temperature_range_data - result: "
-                        + str(result)
-                        + " - runtime: "
-                        + str(f"{self.runtime:.1f}")
-                        + "s"
-                    )
-
                 result = self.read_balance_state(ser) and result
-                if self.runtime > 0.200:  # TROUBLESHOOTING for no reply errors
-                    logger.info(
-                        "  |- refresh_data: read_balance_state - result: "
-                        + str(result)
-                        + " - runtime: "
-                        + str(f"{self.runtime:.1f}")
-                        + "s"
-                    )
-
                 result = self.read_cells_volts(ser) and result
-                if self.runtime > 0.200:  # TROUBLESHOOTING for no reply errors
-                    logger.info(
-                        "  |- refresh_data: read_cells_volts - result: "
-                        + str(result)
-                        + " - runtime: "
-                        + str(f"{self.runtime:.1f}")
-                        + "s"
-                    )
-
                 self.write_charge_discharge_mos(ser)
 
         except OSError:
             logger.warning("Couldn't open serial port")
 
-        if not result:  # TROUBLESHOOTING for no reply errors
-            logger.info("refresh_data: result: " + str(result))
+        self.prefetched = {}
+        self.pipelined = set()
+        self.runtime = monotonic() - time_start
+        if not result or self.runtime > 0.500:  # TROUBLESHOOTING for no reply errors
+            logger.info(
+                "refresh_data: result: "
+                + str(result)
+                + " - runtime: "
+                + str(f"{self.runtime:.3f}")
+                + "s - command gap: "
+                + str(f"{self.command_gap * 1000:.0f}")
+                + "ms"
+            )
         return result
 
+    def get_refresh_requests(self):
+        """
+        Returns the commands and number of reply sentences requested by refresh_data()
+        """
+        requests = [
+            (self.command_soc, 1),
+            (self.command_fet, 1),
+            (self.command_minmax_cell_volts, 1),
+            (self.command_alarm, 1),
+            (self.command_minmax_temp, 1),
+            (self.command_cell_balance, 1),
+        ]
+        if self.cell_count is not None:
+            requests.append((self.command_cell_volts, self.get_cell_sentences()))
+        return requests
+
+    def get_cell_sentences(self):
+        # in each sentence, the bms will send 3 cell voltages
+        # so for a 4s, we will receive 2 sentences
+        return (int(self.cell_count) + 2) // 3
+
     def read_status_data(self, ser):
         status_data = self.request_data(ser, self.command_status)
         # check if connection success
@@ -234,6 +271,7 @@ class Daly(Battery):
                 return True
 
             logger.warning("read_soc_data - triesValid " + str(triesValid))
+            record_transport_event(self.port, self.command_soc, "retries")
         return False
 
     def read_alarm_data(self, ser):
@@ -351,12 +389,7 @@ class Daly(Battery):
             return True
 
         # calculate how many sentences we will receive
-        # in each sentence, the bms will send 3 cell voltages
-        # so for a 4s, we will receive 2 sentences
-        if (int(self.cell_count) % 3) == 0:
-            sentences_expected = int(self.cell_count / 3)
-        else:
-            sentences_expected = int(self.cell_count / 3) + 1
+        sentences_expected = self.get_cell_sentences()
 
         cells_volts_data = self.request_data(
             ser, self.command_cell_volts, sentences_to_receive=sentences_expected
@@ -568,12 +601,10 @@ class Daly(Battery):
         logger.info(f"write soc {self.soc_to_set}%")
         self.soc_to_set = None  # Reset value, so we will set it only once
 
-        ser.flushOutput()
-        ser.flushInput()
-        ser.write(cmd)
+        self.write_command(ser, cmd)
 
         reply = self.read_sentence(ser, self.command_set_soc)
-        if reply[0] != 1:
+        if reply is False or reply[0] != 1:
             logger.error("write soc failed")
         return True
 
@@ -622,9 +653,7 @@ class Daly(Battery):
                 f"write force disable charging: {'true' if self.trigger_force_disable_charge else 'false'}"
             )
             self.trigger_force_disable_charge = None
-            ser.flushOutput()
-            ser.flushInput()
-            ser.write(cmd)
+            self.write_command(ser, cmd)
 
             reply = self.read_sentence(ser, self.command_disable_charge_mos)
             if reply is False or reply[0] != cmd[4]:
@@ -639,9 +668,7 @@ class Daly(Battery):
                 f"write force disable discharging: {'true' if self.trigger_force_disable_discharge else 'false'}"
             )
             self.trigger_force_disable_discharge = None
-            ser.flushOutput()
-            ser.flushInput()
-            ser.write(cmd)
+            self.write_command(ser, cmd)
 
             reply = self.read_sentence(ser, self.command_disable_discharge_mos)
             if reply is False or reply[0] != cmd[4]:
@@ -656,64 +683,184 @@ class Daly(Battery):
         buffer[12] = sum(buffer[:12]) & 0xFF  # checksum calc
         return buffer
 
+    def write_command(self, ser, cmd, flush=True):
+        """
+        Writes the command, after the command gap since the last write has passed
+        """
+        wait = self.last_write + self.command_gap - monotonic()
+        if wait > 0:
+            sleep(wait)
+
+        if flush:
+            ser.flushOutput()
+            ser.flushInput()
+        ser.write(cmd)
+        self.last_write = monotonic()
+
     def request_data(self, ser, command, sentences_to_receive=1):
-        # wait shortly, else the Daly is not ready and throws a lot of no reply errors
-        # if you see a lot of errors, try to increase in steps of 0.005
-        sleep(0.020)
+        # use the reply, if it was already received by request_pipelined()
+        reply = self.prefetched.pop(command[0], None)
+        if reply is not None:
+            return reply
 
-        self.runtime = 0
-        time_start = time()
-        ser.flushOutput()
-        ser.flushInput()
-        ser.write(self.generate_command(command))
+        # the reply was missing in request_pipelined()
+        if command[0] in self.pipelined:
+            self.pipelined.discard(command[0])
+            record_transport_event(self.port, command, "retries")
+
+        time_start = monotonic()
+        self.write_command(ser, self.generate_command(command))
 
         reply = bytearray()
+        error = None
         for i in range(sentences_to_receive):
-            next = self.read_sentence(ser, command)
+            next, error = self.receive_sentence(ser, command)
             if not next:
                 logger.debug(f"request_data: bad reply no. {i}")
-                return False
+                break
             reply += next
-        self.runtime = time() - time_start
-        return reply
+
+        # a timeout is recorded with the request, other errors as event
+        if error is not None and error != "timeouts":
+            record_transport_event(self.port, command, error)
+        record_transport(
+            self.port,
+            command,
+            DalySentenceParser.SENTENCE_SIZE,
+            len(reply) // 8 * DalySentenceParser.SENTENCE_SIZE,
+            monotonic() - time_start,
+            error == "timeouts",
+        )
+        return reply if len(reply) == sentences_to_receive * 8 else False
+
+    def request_pipelined(self, ser, requests):
+        """
+        Sends all commands without waiting for the replies in between, only separated by the
+        command gap, and receives the replies while sending. The replies are demultiplexed by
+        their command and kept for request_data(), which requests missing replies again.
+        Returns True, if all replies were received.
+        """
+        self.prefetched = {}
+        self.pipelined = {command[0] for command, _ in requests}
+        parser = DalySentenceParser()
+        written_at = {}
+
+        ser.flushOutput()
+        ser.flushInput()
+
+        deadline = monotonic()
+        for command, sentences in requests:
+            # receive the replies of the previous commands, while waiting for the gap
+            next_write = max(
+                self.last_write + self.command_gap,
+                monotonic() + serial_wire_time(ser, DalySentenceParser.SENTENCE_SIZE),
+            )
+            parser.feed(read_serial_bytes(ser, 4096, next_write, greedy=True))
+            self.write_command(ser, self.generate_command(command), flush=False)
+            written_at[command[0]] = self.last_write
+
+            deadline = max(
+                deadline,
+                self.last_write
+                + SERIAL_REPLY_TIMEOUT
+                + serial_wire_time(ser, DalySentenceParser.SENTENCE_SIZE * sentences),
+            )
+
+        # wait for the outstanding replies
+        missing = requests
+        while missing:
+            missing = [
+                (command, sentences)
+                for command, sentences in missing
+                if parser.received(command[0]) < sentences
+            ]
+            if not missing or monotonic() >= deadline:
+                break
+            parser.feed(
+                read_serial_bytes(
+                    ser, DalySentenceParser.SENTENCE_SIZE, deadline, greedy=True
+                )
+            )
+
+        for command, sentences in requests:
+            replies = parser.replies.get(command[0], [])
+            complete = len(replies) >= sentences
+            if complete:
+                self.prefetched[command[0]] = bytearray().join(replies[:sentences])
+
+            record_transport(
+                self.port,
+                command,
+                DalySentenceParser.SENTENCE_SIZE,
+                len(replies) * DalySentenceParser.SENTENCE_SIZE,
+                parser.received_at.get(command[0], monotonic()) - written_at[command[0]]
+                if complete
+                else monotonic() - written_at[command[0]],
+                not complete,
+            )
+
+        # sentences with a wrong header or checksum can't be assigned to a command
+        for _ in range(parser.errors):
+            record_transport_event(self.port, "unknown", "checksum_errors")
+
+        # learn the shortest gap the BMS can handle
+        if missing:
+            self.command_gap = min(
+                self.COMMAND_GAP_MAX, self.command_gap + 2 * self.COMMAND_GAP_STEP
+            )
+            logger.debug(
+                f"request_pipelined: {len(missing)} replies missing, {parser.errors} errors,"
+                + f" command gap increased to {self.command_gap * 1000:.0f}ms"
+            )
+        else:
+            self.command_gap = max(
+                self.COMMAND_GAP_MIN, self.command_gap - self.COMMAND_GAP_STEP
+            )
+        return not missing
 
     def read_sentence(self, ser, expected_reply, timeout=0.5):
         """read one 13 byte sentence from daly smart bms.
         return false if less than 13 bytes received in timeout secs, or frame errors occured
         return received datasection as bytearray else
         """
-        time_start = time()
+        reply, error = self.receive_sentence(ser, expected_reply, timeout)
+        if error is not None:
+            record_transport_event(self.port, expected_reply, error)
+        return reply
+
+    def receive_sentence(self, ser, expected_reply, timeout=0.5):
+        """
+        Same as read_sentence(), but doesn't record the error. Returns the data section or False
+        and the error as event name of utils.TransportStats.EVENTS or None
+        """
+        deadline = monotonic() + timeout
 
         reply = ser.read_until(b"\xA5")
         if not reply or b"\xA5" not in reply:
             logger.debug(
                 f"read_sentence {bytes(expected_reply).hex()}: no sentence start received"
             )
-            return False
+            return False, "timeouts"
 
         idx = reply.index(b"\xA5")
         reply = reply[idx:]
-        toread = ser.inWaiting()
-        while toread < 12:
-            sleep((12 - toread) * 0.001)
-            toread = ser.inWaiting()
-            time_run = time() - time_start
-            if time_run > timeout:
-                logger.debug(f"read_sentence {bytes(expected_reply).hex()}: timeout")
-                return False
+        # wait on the port until the rest of the sentence arrived
+        reply += read_serial_bytes(ser, 13 - len(reply), deadline)
+        if len(reply) < 13:
+            logger.debug(f"read_sentence {bytes(expected_reply).hex()}: timeout")
+            return False, "timeouts"
 
-        reply += ser.read(12)
         _, id, cmd, length = unpack_from(">BBBB", reply)
 
         # logger.info(f"reply: {bytes(reply).hex()}")  # debug
 
         if id != 1 or length != 8 or cmd != expected_reply[0]:
             logger.debug(f"read_sentence {bytes(expected_reply).hex()}: wrong header")
-            return False
+            return False, "checksum_errors"
 
         chk = unpack_from(">B", reply, 12)[0]
         if sum(reply[:12]) & 0xFF != chk:
             logger.debug(f"read_sentence {bytes(expected_reply).hex()}: wrong checksum")
-            return False
+            return False, "checksum_errors"
 
-        return reply[4:12]
+        return reply[4:12], None
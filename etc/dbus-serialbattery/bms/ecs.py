@@ -34,7 +34,9 @@ class Ecs(Battery):
         # Trying to find Green Meter ID
         result = False
         try:
-            mbdev = minimalmodbus.Instrument(self.port, utils.GREENMETER_ADDRESS)
+            mbdev = utils.instrument_modbus(
+                minimalmodbus.Instrument(self.port, utils.GREENMETER_ADDRESS), self.port
+            )
             mbdev.serial.parity = minimalmodbus.serial.PARITY_EVEN
             tmpId = mbdev.read_register(0, 0)
             if tmpId in range(self.GREENMETER_ID_500A, self.GREENMETER_ID_125A + 1):
@@ -74,7 +76,9 @@ class Ecs(Battery):
             utils.LIPRO_START_ADDRESS, utils.LIPRO_END_ADDRESS + 1
         ):
             try:
-                mbdev = minimalmodbus.Instrument(self.port, cell_address)
+                mbdev = utils.instrument_modbus(
+                    minimalmodbus.Instrument(self.port, cell_address), self.port
+                )
                 mbdev.serial.parity = minimalmodbus.serial.PARITY_EVEN
 
                 tmpId = mbdev.read_register(0, 0)
@@ -114,7 +118,9 @@ class Ecs(Battery):
 
     def read_status_data(self):
         try:
-            mbdev = minimalmodbus.Instrument(self.port, utils.GREENMETER_ADDRESS)
+            mbdev = utils.instrument_modbus(
+                minimalmodbus.Instrument(self.port, utils.GREENMETER_ADDRESS), self.port
+            )
             mbdev.serial.parity = minimalmodbus.serial.PARITY_EVEN
 
             self.max_battery_discharge_current = abs(
@@ -140,7 +146,9 @@ class Ecs(Battery):
 
     def read_soc_data(self):
         try:
-            mbdev = minimalmodbus.Instrument(self.port, utils.GREENMETER_ADDRESS)
+            mbdev = utils.instrument_modbus(
+                minimalmodbus.Instrument(self.port, utils.GREENMETER_ADDRESS), self.port
+            )
             mbdev.serial.parity = minimalmodbus.serial.PARITY_EVEN
 
             self.voltage = (
@@ -193,7 +201,10 @@ class Ecs(Battery):
     def read_cell_data(self):
         for cell in range(len(self.LiProCells)):
             try:
-                mbdev = minimalmodbus.Instrument(self.port, self.LiProCells[cell])
+                mbdev = utils.instrument_modbus(
+                    minimalmodbus.Instrument(self.port, self.LiProCells[cell]),
+                    self.port,
+                )
                 mbdev.serial.parity = minimalmodbus.serial.PARITY_EVEN
 
                 self.cells[cell].voltage = mbdev.read_register(100, 0, 3, False) / 1000
@@ -45,12 +45,15 @@ class HeltecModbus(Battery):
             # are supported on the same serial interface. Then locking on the port will be enough.
 
             with locks[self.address]:
-                mbdev = minimalmodbus.Instrument(
+                mbdev = utils.instrument_modbus(
+                    minimalmodbus.Instrument(
+                        self.port,
+                        slaveaddress=self.address,
+                        mode="rtu",
+                        close_port_after_each_call=True,
+                        debug=False,
+                    ),
                     self.port,
-                    slaveaddress=self.address,
-                    mode="rtu",
-                    close_port_after_each_call=True,
-                    debug=False,
                 )
                 mbdev.serial.parity = minimalmodbus.serial.PARITY_NONE
                 mbdev.serial.stopbits = serial.STOPBITS_ONE
@@ -219,6 +222,7 @@ class HeltecModbus(Battery):
                     # we finished all readings without trouble, so let's break from the retry loop
                     break
                 except Exception as e:
+                    utils.record_transport_event(self.port, "settings", "retries")
                     logger.warn(
                         "Error reading settings from BMS, retry ("
                         + str(n)
@@ -384,6 +388,7 @@ class HeltecModbus(Battery):
                     return True
 
                 except Exception as e:
+                    utils.record_transport_event(self.port, "soc", "retries")
                     logger.warn(
                         "Error reading SOC, retry ("
                         + str(n)
@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 from battery import Battery, Cell
-from utils import logger
+from utils import serial_port_session, logger
 import utils
 import serial
 from time import sleep
@@ -204,7 +204,7 @@ class HLPdataBMS4S(Battery):
 
 def read_serial_data2(command, port, baud, time, min_len):
     try:
-        with serial.Serial(port, baudrate=baud, timeout=0.5) as ser:
+        with serial_port_session(port, baud, timeout=0.5) as ser:
             ret = read_serialport_data2(ser, command, time, min_len)
             if ret is True:
                 return ret
@@ -218,23 +218,20 @@ def read_serial_data2(command, port, baud, time, min_len):
         return False
 
 
+# A SerialException is passed on to serial_port_session(), which closes the port,
+# so that it's reopened on the next request
 def read_serialport_data2(ser, command, time, min_len):
-    try:
-        cnt = 0
-        while cnt < 3:
-            cnt += 1
-            ser.flushOutput()
-            ser.flushInput()
-            ser.write(command)
-            sleep(time)
-            res = ser.read(1000)
-            if len(res) >= min_len:
-                return res
-        return False
-
-    except serial.SerialException as e:
-        logger.error(e)
-        return False
+    cnt = 0
+    while cnt < 3:
+        cnt += 1
+        ser.flushOutput()
+        ser.flushInput()
+        ser.write(command)
+        sleep(time)
+        res = ser.read(1000)
+        if len(res) >= min_len:
+            return res
+    return False
 
 
 def get_par(p, s):
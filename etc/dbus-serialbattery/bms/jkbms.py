@@ -2,20 +2,131 @@
 from battery import Battery, Cell
 from utils import is_bit_set, read_serial_data, logger
 import utils
-from struct import unpack_from
+from struct import Struct, unpack_from
+from typing import Dict, Union
 from re import sub
 
 
+# size of the value of each field id in the status frame
+# 0x79 (cell voltages) is not listed, since its value starts with its own length byte
+JK_FIELD_SIZES = {
+    **{field_id: 2 for field_id in range(0x80, 0x85)},
+    0x85: 1,
+    0x86: 1,
+    0x87: 2,
+    0x89: 4,
+    0x8A: 2,
+    0x8B: 2,
+    0x8C: 2,
+    **{field_id: 2 for field_id in range(0x8E, 0x9D)},
+    0x9D: 1,
+    **{field_id: 2 for field_id in range(0x9E, 0xA9)},
+    0xA9: 1,
+    0xAA: 4,
+    0xAB: 1,
+    0xAC: 1,
+    0xAD: 2,
+    0xAE: 1,
+    0xAF: 1,
+    0xB0: 2,
+    0xB1: 1,
+    0xB2: 10,
+    0xB3: 1,
+    0xB4: 8,
+    0xB5: 4,
+    0xB6: 4,
+    0xB7: 15,
+    0xB8: 1,
+    0xB9: 4,
+    0xBA: 24,
+    0xC0: 1,
+}
+
+# structs of the fields read by the driver, compiled once
+JK_FIELD_STRUCTS = {
+    field_id: Struct(">B" if size == 1 else ">H" if size == 2 else ">L")
+    for field_id, size in JK_FIELD_SIZES.items()
+    if size in (1, 2, 4)
+}
+JK_FIELD_STRUCTS.update(
+    {
+        0xB4: Struct(">8s"),
+        0xB5: Struct(">4s"),
+        0xB7: Struct(">15s"),
+        0xBA: Struct(">24s"),
+    }
+)
+JK_CELL_STRUCT = Struct(">xH")
+
+
+def index_jk_fields(data) -> Dict[int, int]:
+    """
+    Walks the fields of a JKBMS status frame once and returns the offset of each value by field id.
+    The first byte of the data is the frame type. The walk stops at the first unknown field id,
+    since the size of its value is unknown.
+    """
+    fields = {}
+    end = len(data)
+    index = 1
+    while index < end:
+        field_id = data[index]
+        if field_id == 0x79:
+            if index + 1 >= end:
+                break
+            size = 1 + data[index + 1]
+        else:
+            size = JK_FIELD_SIZES.get(field_id)
+            if size is None:
+                break
+        if index + 1 + size > end:
+            break
+        fields[field_id] = index + 1
+        index += 1 + size
+    return fields
+
+
+def get_jk_field(data, fields: Dict[int, int], field_id: int):
+    """
+    Returns the value of the field from a status frame indexed by index_jk_fields()
+    """
+    return JK_FIELD_STRUCTS[field_id].unpack_from(data, fields[field_id])[0]
+
+
 class Jkbms(Battery):
     def __init__(self, port, baud, address):
         super(Jkbms, self).__init__(port, baud, address)
         self.type = self.BATTERYTYPE
+        # field offsets of the last status data, see index_status_data()
+        self.status_fields_key = None
+        self.status_fields = {}
 
     BATTERYTYPE = "Jkbms"
     LENGTH_CHECK = 1
     LENGTH_POS = 2
     LENGTH_SIZE = "H"
     CURRENT_ZERO_CONSTANT = 32768
+    # fields of the status data read by read_status_data()
+    STATUS_FIELDS = (
+        0x79,
+        0x80,
+        0x81,
+        0x82,
+        0x83,
+        0x84,
+        0x85,
+        0x87,
+        0x8A,
+        0x8B,
+        0x8C,
+        0x97,
+        0x99,
+        0x9D,
+        0xAA,
+        0xB4,
+        0xB5,
+        0xB7,
+        0xBA,
+    )
     command_status = b"\x4E\x57\x00\x13\x00\x00\x00\x00\x06\x03\x00\x00\x00\x00\x00\x00\x68\x00\x00\x01\x29"
 
     def test_connection(self):
@@ -55,13 +166,32 @@ class Jkbms(Battery):
 
         return result
 
-    def get_data(self, bytes, idcode, start, length):
-        # logger.debug("start "+str(start) + " length " + str(length))
-        # logger.debug(binascii.hexlify(bytearray(bytes[start:start + 1 + length])).decode('ascii'))
-        start = bytes.find(idcode, start, start + 1 + length)
-        if start < 0:
-            return False
-        return bytes[start + 1 : start + length + 1]
+    def index_status_data(self, status_data) -> Union[Dict[int, int], None]:
+        """
+        Returns the offsets of the fields in the status data. The layout is the same for every
+        frame of a BMS, therefore the frame is only indexed again, if its length changes or
+        a field is not at its place anymore. Returns None, if a field is missing.
+        """
+        key = (len(status_data), status_data[2])
+        if key == self.status_fields_key and self.check_status_fields(
+            status_data, self.status_fields
+        ):
+            return self.status_fields
+
+        fields = index_jk_fields(status_data)
+        if not self.check_status_fields(status_data, fields):
+            return None
+
+        self.status_fields_key = key
+        self.status_fields = fields
+        return fields
+
+    def check_status_fields(self, status_data, fields: Dict[int, int]) -> bool:
+        for field_id in self.STATUS_FIELDS:
+            offset = fields.get(field_id)
+            if offset is None or status_data[offset - 1] != field_id:
+                return False
+        return True
 
     def read_status_data(self):
         status_data = self.read_serial_data_jkbms(self.command_status)
@@ -69,45 +199,44 @@ class Jkbms(Battery):
         if status_data is False:
             return False
 
+        # the values of the last reply are still valid
+        if self.is_frame_unchanged(self.command_status, status_data):
+            return True
+
+        fields = self.index_status_data(status_data)
+        if fields is None:
+            logger.error(">>> ERROR: Missing fields in status data")
+            return False
+
+        def get_field(field_id):
+            return get_jk_field(status_data, fields, field_id)
+
         # cell voltages
-        offset = 1
-        cellbyte_count = unpack_from(
-            ">B", self.get_data(status_data, b"\x79", offset, 1)
-        )[0]
-
-        offset = cellbyte_count + 30
-        self.cell_count = unpack_from(
-            ">H", self.get_data(status_data, b"\x8A", offset, 2)
-        )[0]
-
-        if cellbyte_count == 3 * self.cell_count and self.cell_count == len(self.cells):
-            offset = 1
-            celldata = self.get_data(status_data, b"\x79", offset, 1 + cellbyte_count)
-            for c in range(self.cell_count):
-                self.cells[c].voltage = (
-                    unpack_from(">xH", celldata, c * 3 + 1)[0] / 1000
-                )
+        self.cell_count = get_field(0x8A)
+        offset = fields[0x79]
+        cellbyte_count = status_data[offset]
+        cells_parsed = cellbyte_count == 3 * self.cell_count and self.cell_count == len(
+            self.cells
+        )
+        if cells_parsed:
+            celldata = memoryview(status_data)[offset + 1 : offset + 1 + cellbyte_count]
+            self.cells.set_voltages(
+                voltage / 1000 for (voltage,) in JK_CELL_STRUCT.iter_unpack(celldata)
+            )
 
         # MOSFET temperature
-        offset = cellbyte_count + 3
-        temp_mos = unpack_from(">H", self.get_data(status_data, b"\x80", offset, 2))[0]
+        temp_mos = get_field(0x80)
         self.to_temp(0, temp_mos if temp_mos < 99 else (100 - temp_mos))
 
         # Temperature sensors
-        offset = cellbyte_count + 6
-        temp1 = unpack_from(">H", self.get_data(status_data, b"\x81", offset, 2))[0]
-
-        offset = cellbyte_count + 9
-        temp2 = unpack_from(">H", self.get_data(status_data, b"\x82", offset, 2))[0]
+        temp1 = get_field(0x81)
+        temp2 = get_field(0x82)
         self.to_temp(1, temp1 if temp1 < 99 else (100 - temp1))
         self.to_temp(2, temp2 if temp2 < 99 else (100 - temp2))
 
-        offset = cellbyte_count + 12
-        voltage = unpack_from(">H", self.get_data(status_data, b"\x83", offset, 2))[0]
-        self.voltage = voltage / 100
+        self.voltage = get_field(0x83) / 100
 
-        offset = cellbyte_count + 15
-        current = unpack_from(">H", self.get_data(status_data, b"\x84", offset, 2))[0]
+        current = get_field(0x84)
         self.current = (
             current / -100
             if current < self.CURRENT_ZERO_CONSTANT
@@ -115,79 +244,43 @@ class Jkbms(Battery):
         )
 
         # Continued discharge current
-        offset = cellbyte_count + 66
-        self.max_battery_discharge_current = float(
-            unpack_from(">H", self.get_data(status_data, b"\x97", offset, 2))[0]
-        )
+        self.max_battery_discharge_current = float(get_field(0x97))
 
         # Continued charge current
-        offset = cellbyte_count + 72
-        self.max_battery_charge_current = float(
-            unpack_from(">H", self.get_data(status_data, b"\x99", offset, 2))[0]
-        )
+        self.max_battery_charge_current = float(get_field(0x99))
 
-        offset = cellbyte_count + 18
-        self.soc = unpack_from(">B", self.get_data(status_data, b"\x85", offset, 1))[0]
+        self.soc = get_field(0x85)
 
-        offset = cellbyte_count + 22
-        self.cycles = unpack_from(">H", self.get_data(status_data, b"\x87", offset, 2))[
-            0
-        ]
+        self.cycles = get_field(0x87)
 
-        # offset = cellbyte_count + 25
-        # self.capacity_remain = unpack_from('>L', self.get_data(status_data, b'\x89', offset, 4))[0]
-        offset = cellbyte_count + 121
-        self.capacity = unpack_from(
-            ">L", self.get_data(status_data, b"\xAA", offset, 4)
-        )[0]
+        # self.capacity_remain = get_field(0x89)
+        self.capacity = get_field(0xAA)
 
-        offset = cellbyte_count + 33
-        self.to_protection_bits(
-            unpack_from(">H", self.get_data(status_data, b"\x8B", offset, 2))[0]
-        )
+        self.to_protection_bits(get_field(0x8B))
 
-        offset = cellbyte_count + 36
-        self.to_fet_bits(
-            unpack_from(">H", self.get_data(status_data, b"\x8C", offset, 2))[0]
-        )
+        self.to_fet_bits(get_field(0x8C))
 
-        offset = cellbyte_count + 84
-        self.to_balance_bits(
-            unpack_from(">B", self.get_data(status_data, b"\x9D", offset, 1))[0]
-        )
+        self.to_balance_bits(get_field(0x9D))
 
         # "User Private Data" field in APP
-        offset = cellbyte_count + 155
         tmp = sub(
             " +",
             " ",
-            (
-                unpack_from(">8s", self.get_data(status_data, b"\xB4", offset, 8))[0]
-                .decode()
-                .replace("\x00", " ")
-                .strip()
-            ),
+            (get_field(0xB4).decode().replace("\x00", " ").strip()),
         )
         self.custom_field = tmp if tmp != "Input Us" else None
 
         # production date
-        offset = cellbyte_count + 164
-        tmp = unpack_from(">4s", self.get_data(status_data, b"\xB5", offset, 4))[
-            0
-        ].decode()
+        tmp = get_field(0xB5).decode()
         self.production = "20" + tmp + "01" if tmp and tmp != "" else None
 
-        offset = cellbyte_count + 174
-        self.version = unpack_from(
-            ">15s", self.get_data(status_data, b"\xB7", offset, 15)
-        )[0].decode()
+        self.version = get_field(0xB7).decode()
 
-        offset = cellbyte_count + 197
         self.unique_identifier = sub(
             " +",
             " ",
             (
-                unpack_from(">24s", self.get_data(status_data, b"\xBA", offset, 24))[0]
+                get_field(0xBA)
                 .decode()
                 .replace("\x00", " ")
                 .replace("Input Userda", "")
@@ -196,14 +289,18 @@ class Jkbms(Battery):
         )
 
         # show wich cells are balancing
-        if self.get_min_cell() is not None and self.get_max_cell() is not None:
-            for c in range(self.cell_count):
-                if self.balancing and (
-                    self.get_min_cell() == c or self.get_max_cell() == c
-                ):
-                    self.cells[c].balance = True
-                else:
-                    self.cells[c].balance = False
+        min_cell = self.get_min_cell()
+        max_cell = self.get_max_cell()
+        if min_cell is not None and max_cell is not None:
+            self.cells.set_balances(
+                self.balancing and (min_cell == c or max_cell == c)
+                for c in range(self.cell_count)
+            )
+
+        # the cells are not created before get_settings(), therefore the same reply has to be
+        # parsed again, if the cell voltages were not set
+        if cells_parsed:
+            self.frame_parsed(self.command_status, status_data)
 
         # logger.info(self.hardware_version)
         return True
@@ -221,30 +318,6 @@ class Jkbms(Battery):
     def get_balancing(self):
         return 1 if self.balancing else 0
 
-    def get_min_cell(self):
-        min_voltage = 9999
-        min_cell = None
-        for c in range(min(len(self.cells), self.cell_count)):
-            if (
-                self.cells[c].voltage is not None
-                and min_voltage > self.cells[c].voltage
-            ):
-                min_voltage = self.cells[c].voltage
-                min_cell = c
-        return min_cell
-
-    def get_max_cell(self):
-        max_voltage = 0
-        max_cell = None
-        for c in range(min(len(self.cells), self.cell_count)):
-            if (
-                self.cells[c].voltage is not None
-                and max_voltage < self.cells[c].voltage
-            ):
-                max_voltage = self.cells[c].voltage
-                max_cell = c
-        return max_cell
-
     def to_protection_bits(self, byte_data):
         """
         Bit 0: Low capacity alarm: 1 warning only, 0 nomal -> OK
@@ -166,8 +166,7 @@ class Jkbms_Ble(Battery):
         else:
             self.resetting = False
 
-        for c in range(self.cell_count):
-            self.cells[c].voltage = st["cell_info"]["voltages"][c]
+        self.cells.set_voltages(st["cell_info"]["voltages"][: self.cell_count])
 
         self.to_temp(0, st["cell_info"]["temperature_mos"])
         self.to_temp(1, st["cell_info"]["temperature_sensor_1"])
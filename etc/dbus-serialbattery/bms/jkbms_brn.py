@@ -3,7 +3,7 @@ from bleak import BleakScanner, BleakClient
 import time
 from logging import info, debug
 import logging
-from struct import unpack_from, calcsize
+from struct import Struct
 import threading
 
 logging.basicConfig(level=logging.INFO)
@@ -28,6 +28,7 @@ protocol_version = PROTOCOL_VERSION_JK02
 
 MIN_RESPONSE_SIZE = 300
 MAX_RESPONSE_SIZE = 320
+FRAME_START = b"\x55\xaa\xeb\x90"
 
 TRANSLATE_DEVICE_INFO = [
     [["device_info", "hw_rev"], 22, "8s"],
@@ -80,19 +81,94 @@ TRANSLATE_CELL_INFO = [
     [["cell_info", "balancing_active"], 191, "1?"],
 ]
 
+WARNING_BITS = [
+    ["resistance_too_high", 0],
+    ["cell_count_wrong", 2],  # ?
+    ["charge_overtemp", 8],
+    ["charge_undertemp", 9],
+    ["discharge_overtemp", 15],
+    ["cell_overvoltage", 4],
+    ["cell_undervoltage", 11],
+    ["charge_overcurrent", 6],
+    ["discharge_overcurrent", 13],
+    # bis hierhin verifiziert, rest zu testen
+]
+
+WARNINGS = Struct("<H")
+WARNINGS_OFFSET = 136
+
+
+def compile_translation(translation, f32s=False):
+    """
+    Compiles a translation table into a flat decode plan of
+    (key, count, struct, offset, factor, is_string) entries.
+    Arrays like the cell voltages are unpacked in one call (e.g. "<32H")
+    and 32s frames get their offsets shifted at compile time.
+    """
+    plan = []
+    for path, offset, fmt, *factor in translation:
+        count = path[2] if len(path) == 3 else None
+        if count is not None:
+            # "<H" with 32 entries becomes "<32H"
+            fmt = fmt[0] + str(count) + fmt[1:]
+        if f32s:
+            if offset >= 112:
+                offset += 32
+            elif offset >= 54:
+                offset += 16
+        plan.append(
+            (
+                path[1],
+                count,
+                Struct(fmt),
+                offset,
+                factor[0] if factor else None,
+                fmt.endswith("s"),
+            )
+        )
+    return plan
+
+
+DECODE_DEVICE_INFO = compile_translation(TRANSLATE_DEVICE_INFO)
+DECODE_SETTINGS = compile_translation(TRANSLATE_SETTINGS)
+DECODE_CELL_INFO = compile_translation(TRANSLATE_CELL_INFO)
+DECODE_CELL_INFO_32S = compile_translation(TRANSLATE_CELL_INFO, f32s=True)
+
+
+def new_status():
+    """
+    Preallocates the status with all keys of the translation tables, so that
+    decoding a frame only updates values and never changes the structure
+    """
+    status = {"model_nbr": None, "last_update": None, "warnings": {}}
+    for translation in (TRANSLATE_DEVICE_INFO, TRANSLATE_SETTINGS, TRANSLATE_CELL_INFO):
+        for path, *_ in translation:
+            section = status.setdefault(path[0], {})
+            section[path[1]] = [None] * path[2] if len(path) == 3 else None
+    status["cell_info"]["error_bitmask_16"] = None
+    status["cell_info"]["error_bitmask_2"] = None
+    status["cell_info"]["power"] = None
+    for name, _ in WARNING_BITS:
+        status["warnings"][name] = None
+    return status
+
 
 class Jkbms_Brn:
     # entries for translating the bytearray to py-object via unpack
     # [[py dict entry as list, each entry ] ]
 
-    frame_buffer = bytearray()
-    bms_status = {}
-
     waiting_for_response = ""
     last_cell_info = 0
 
     def __init__(self, addr):
         self.address = addr
+        # fixed size frame buffer of this instance, filled by the notifications
+        self.frame_buffer = bytearray(MAX_RESPONSE_SIZE)
+        self.frame_view = memoryview(self.frame_buffer)
+        self.frame_length = 0
+        self.bms_status = new_status()
+        # sections of bms_status, which were decoded at least once
+        self.decoded = set()
         self.bt_thread = threading.Thread(target=self.connect_and_scrape)
 
     async def scanForDevices(self):
@@ -100,115 +176,67 @@ class Jkbms_Brn:
         for d in devices:
             print(d)
 
-    # iterative implementation maybe later due to referencing
-    def translate(self, fb, translation, o, f32s=False, i=0):
-        if i == len(translation[0]) - 1:
-            # keep things universal by using an n=1 list
-            kees = (
-                range(0, translation[0][i])
-                if isinstance(translation[0][i], int)
-                else [translation[0][i]]
-            )
-            offset = 0
-            if f32s:
-                if translation[1] >= 112:
-                    offset = 32
-                elif translation[1] >= 54:
-                    offset = 16
-            i = 0
-            for j in kees:
-                if isinstance(translation[2], int):
-                    # handle raw bytes without unpack_from;
-                    # 3. param gives no format but number of bytes
-                    val = bytearray(
-                        fb[
-                            translation[1]
-                            + i
-                            + offset : translation[1]
-                            + i
-                            + translation[2]
-                            + offset
-                        ]
-                    )
-                    i += translation[2]
-                else:
-                    val = unpack_from(
-                        translation[2], bytearray(fb), translation[1] + i + offset
-                    )[0]
-                    # calculate stepping in case of array
-                    i = i + calcsize(translation[2])
-
-                if isinstance(val, bytes):
-                    try:
-                        val = val.decode("utf-8").rstrip(" \t\n\r\0")
-                    except UnicodeDecodeError:
-                        val = ""
-
-                elif isinstance(val, int) and len(translation) == 4:
-                    val = val * translation[3]
-                o[j] = val
-        else:
-            if translation[0][i] not in o:
-                if len(translation[0]) == i + 2 and isinstance(
-                    translation[0][i + 1], int
-                ):
-                    o[translation[0][i]] = [None] * translation[0][i + 1]
-                else:
-                    o[translation[0][i]] = {}
-
-            self.translate(fb, translation, o[translation[0][i]], f32s=f32s, i=i + 1)
+    def translate(self, fb, plan, o, limit=None):
+        for key, count, struct, offset, factor, is_string in plan:
+            if count is not None:
+                values = struct.unpack_from(fb, offset)
+                if factor is not None:
+                    values = [value * factor for value in values]
+                # only the connected cells are valid, keep the rest untouched
+                n = limit if key == "voltages" and limit else count
+                o[key][:n] = values[:n]
+                continue
+
+            val = struct.unpack_from(fb, offset)[0]
+            if is_string:
+                try:
+                    val = val.decode("utf-8").rstrip(" \t\n\r\0")
+                except UnicodeDecodeError:
+                    val = ""
+            elif factor is not None:
+                val = val * factor
+            o[key] = val
 
     def decode_warnings(self, fb):
-        val = unpack_from("<H", bytearray(fb), 136)[0]
+        val = WARNINGS.unpack_from(fb, WARNINGS_OFFSET)[0]
 
         self.bms_status["cell_info"]["error_bitmask_16"] = hex(val)
         self.bms_status["cell_info"]["error_bitmask_2"] = format(val, "016b")
 
-        if "warnings" not in self.bms_status:
-            self.bms_status["warnings"] = {}
-
-        self.bms_status["warnings"]["resistance_too_high"] = bool(val & (1 << 0))
-        self.bms_status["warnings"]["cell_count_wrong"] = bool(val & (1 << 2))  # ?
-        self.bms_status["warnings"]["charge_overtemp"] = bool(val & (1 << 8))
-        self.bms_status["warnings"]["charge_undertemp"] = bool(val & (1 << 9))
-        self.bms_status["warnings"]["discharge_overtemp"] = bool(val & (1 << 15))
-        self.bms_status["warnings"]["cell_overvoltage"] = bool(val & (1 << 4))
-        self.bms_status["warnings"]["cell_undervoltage"] = bool(val & (1 << 11))
-        self.bms_status["warnings"]["charge_overcurrent"] = bool(val & (1 << 6))
-        self.bms_status["warnings"]["discharge_overcurrent"] = bool(val & (1 << 13))
-        # bis hierhin verifiziert, rest zu testen
-
-    def decode_device_info_jk02(self):
-        fb = self.frame_buffer
-        for t in TRANSLATE_DEVICE_INFO:
-            self.translate(fb, t, self.bms_status)
-
-    def decode_cellinfo_jk02(self):
-        fb = self.frame_buffer
+        warnings = self.bms_status["warnings"]
+        for name, bit in WARNING_BITS:
+            warnings[name] = bool(val & (1 << bit))
+
+    def decode_device_info_jk02(self, fb):
+        self.translate(fb, DECODE_DEVICE_INFO, self.bms_status["device_info"])
+        self.decoded.add("device_info")
+
+    def decode_cellinfo_jk02(self, fb):
         has32s = fb[189] == 0x00 and fb[189 + 32] > 0
-        for t in TRANSLATE_CELL_INFO:
-            self.translate(fb, t, self.bms_status, f32s=has32s)
+        self.translate(
+            fb,
+            DECODE_CELL_INFO_32S if has32s else DECODE_CELL_INFO,
+            self.bms_status["cell_info"],
+            limit=self.bms_status["settings"]["cell_count"],
+        )
         self.decode_warnings(fb)
+        self.decoded.add("cell_info")
         debug(self.bms_status)
 
-    def decode_settings_jk02(self):
-        fb = self.frame_buffer
-        for t in TRANSLATE_SETTINGS:
-            self.translate(fb, t, self.bms_status)
+    def decode_settings_jk02(self, fb):
+        self.translate(fb, DECODE_SETTINGS, self.bms_status["settings"])
+        self.decoded.add("settings")
         debug(self.bms_status)
 
     def decode(self):
+        # decode in place, the buffer is not touched until the frame is processed
+        fb = self.frame_view[: self.frame_length]
         # check what kind of info the frame contains
-        info_type = self.frame_buffer[4]
+        info_type = fb[4]
         if info_type == 0x01:
             info("Processing frame with settings info")
             if protocol_version == PROTOCOL_VERSION_JK02:
-                self.decode_settings_jk02()
-                # adapt translation table for cell array lengths
-                ccount = self.bms_status["settings"]["cell_count"]
-                for i, t in enumerate(TRANSLATE_CELL_INFO):
-                    if t[0][-2] == "voltages" or t[0][-2] == "voltages":
-                        TRANSLATE_CELL_INFO[i][0][-1] = ccount
+                self.decode_settings_jk02(fb)
                 self.bms_status["last_update"] = time.time()
 
         elif info_type == 0x02:
@@ -219,7 +247,7 @@ class Jkbms_Brn:
                 self.last_cell_info = time.time()
                 info("processing frame with battery cell info")
                 if protocol_version == PROTOCOL_VERSION_JK02:
-                    self.decode_cellinfo_jk02()
+                    self.decode_cellinfo_jk02(fb)
                     self.bms_status["last_update"] = time.time()
                 # power is calculated from voltage x current as
                 # register 122 contains unsigned power-value
@@ -233,7 +261,7 @@ class Jkbms_Brn:
         elif info_type == 0x03:
             info("processing frame with device info")
             if protocol_version == PROTOCOL_VERSION_JK02:
-                self.decode_device_info_jk02()
+                self.decode_device_info_jk02(fb)
                 self.bms_status["last_update"] = time.time()
             else:
                 return
@@ -241,36 +269,55 @@ class Jkbms_Brn:
                 self.waiting_for_response = ""
 
     def assemble_frame(self, data: bytearray):
-        if len(self.frame_buffer) > MAX_RESPONSE_SIZE:
+        size = len(data)
+        if size > MAX_RESPONSE_SIZE:
             info("data dropped because it alone was longer than max frame length")
-            self.frame_buffer = []
+            self.frame_length = 0
+            return
+
+        if data.startswith(FRAME_START) or self.frame_length + size > MAX_RESPONSE_SIZE:
+            # beginning of new frame or overflow, clear buffer
+            self.frame_length = 0
 
-        if data[0] == 0x55 and data[1] == 0xAA and data[2] == 0xEB and data[3] == 0x90:
-            # beginning of new frame, clear buffer
-            self.frame_buffer = []
+        self.frame_view[self.frame_length : self.frame_length + size] = data
+        self.frame_length += size
 
-        self.frame_buffer.extend(data)
+        if self.frame_length >= len(FRAME_START) and not self.frame_buffer.startswith(
+            FRAME_START
+        ):
+            self.resync_frame()
 
-        if len(self.frame_buffer) >= MIN_RESPONSE_SIZE:
+        if self.frame_length >= MIN_RESPONSE_SIZE:
             # check crc; always at position 300, independent of
             # actual frame-lentgh, so crc up to 299
-            ccrc = self.crc(self.frame_buffer, 300 - 1)
+            ccrc = self.crc(self.frame_view, 300 - 1)
             rcrc = self.frame_buffer[300 - 1]
             debug(f"compair recvd. crc: {rcrc} vs calc. crc: {ccrc}")
             if ccrc == rcrc:
                 debug("great success! frame complete and sane, lets decode")
                 self.decode()
-                self.frame_buffer = []
+                self.frame_length = 0
+
+    def resync_frame(self):
+        """
+        Drops the bytes in front of the next start marker, e.g. after connecting
+        in the middle of a frame. If there is no marker, only the last bytes are
+        kept, since they can be the beginning of a marker split over two notifications.
+        """
+        start = self.frame_buffer.find(FRAME_START, 1, self.frame_length)
+        if start < 0:
+            start = self.frame_length - len(FRAME_START) + 1
+        length = self.frame_length - start
+        self.frame_view[:length] = self.frame_view[start : self.frame_length]
+        self.frame_length = length
 
     def ncallback(self, sender: int, data: bytearray):
         debug(f"------> NEW PACKAGE!laenge:  {len(data)}")
         self.assemble_frame(data)
 
     def crc(self, arr: bytearray, length: int) -> int:
-        crc = 0
-        for a in arr[:length]:
-            crc = crc + a
-        return crc.to_bytes(2, "little")[0]
+        # the lowest byte of the sum, calculated without copying the frame
+        return sum(memoryview(arr)[:length]) & 0xFF
 
     async def write_register(
         self, address, vals: bytearray, length: int, bleakC: BleakClient
@@ -318,7 +365,7 @@ class Jkbms_Brn:
         await self.write_register(cmd, b"\0\0\0\0", 0x00, client)
 
     def get_status(self):
-        if "settings" in self.bms_status and "cell_info" in self.bms_status:
+        if "settings" in self.decoded and "cell_info" in self.decoded:
             return self.bms_status
         else:
             return None
@@ -360,7 +407,8 @@ class Jkbms_Brn:
         print("Exiting bt-loop")
 
     def start_scraping(self):
-        self.main_thread = threading.current_thread()
+        # the bluetooth thread runs until the driver exits, independent of the detection thread
+        self.main_thread = threading.main_thread()
         if self.is_running():
             return
         self.bt_thread.start()
@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 from battery import Protection, Battery, Cell
-from utils import is_bit_set, read_serial_data, logger
+from utils import is_bit_set, read_serial_data, record_transport_event, logger
 import utils
 from struct import unpack_from
 import struct
@@ -223,6 +223,12 @@ class LltJbd(Battery):
     LENGTH_CHECK = 6
     LENGTH_POS = 3
 
+    # the general data contains voltage, current, soc, fets and alarms
+    REFRESH_GROUPS = (
+        ("read_gen_data", 0),
+        ("read_cell_data", 2),
+    )
+
     command_general = readCmd(REG_GENERAL)  # b"\xDD\xA5\x03\x00\xFF\xFD\x77"
     command_cell = readCmd(REG_CELL)  # b"\xDD\xA5\x04\x00\xFF\xFC\x77"
     command_hardware = readCmd(REG_HARDWARE)  # b"\xDD\xA5\x05\x00\xFF\xFB\x77"
@@ -289,9 +295,7 @@ class LltJbd(Battery):
             self.read_serial_data_llt(writeCmd(REG_CAP_100, pack_voltage))
 
     def refresh_data(self):
-        result = self.read_gen_data()
-        result = result and self.read_cell_data()
-        return result
+        return self.refresh_groups()
 
     def to_protection_bits(self, byte_data):
         tmp = bin(byte_data)[2:].rjust(13, utils.zero_char)
@@ -352,11 +356,9 @@ class LltJbd(Battery):
             # cell17, cell18, ..., cell32
             # ]
 
-        for c in range(self.cell_count):
-            if is_bit_set(tmp_reversed[c]):
-                self.cells[c].balance = True
-            else:
-                self.cells[c].balance = False
+        self.cells.set_balances(
+            is_bit_set(tmp_reversed[c]) for c in range(self.cell_count)
+        )
 
         """
         # clear the list
@@ -384,6 +386,10 @@ class LltJbd(Battery):
         if gen_data is False or len(gen_data) < 27:
             return False
 
+        # the values of the last reply are still valid
+        if self.is_frame_unchanged(self.command_general, gen_data):
+            return True
+
         (
             voltage,
             current,
@@ -419,6 +425,7 @@ class LltJbd(Battery):
             temp1 = unpack_from(">H", gen_data, 23 + (2 * t))[0]
             self.to_temp(t, utils.kelvin_to_celsius(temp1 / 10))
 
+        self.frame_parsed(self.command_general, gen_data)
         return True
 
     def read_cell_data(self):
@@ -427,13 +434,14 @@ class LltJbd(Battery):
         if cell_data is False or len(cell_data) < self.cell_count * 2:
             return False
 
-        for c in range(self.cell_count):
-            try:
-                cell_volts = unpack_from(">H", cell_data, c * 2)
-                if len(cell_volts) != 0:
-                    self.cells[c].voltage = cell_volts[0] / 1000
-            except struct.error:
-                self.cells[c].voltage = 0
+        if self.is_frame_unchanged(self.command_cell, cell_data):
+            return True
+
+        self.cells.set_voltages(
+            voltage / 1000
+            for (voltage,) in struct.iter_unpack(">H", cell_data[: self.cell_count * 2])
+        )
+        self.frame_parsed(self.command_cell, cell_data)
         return True
 
     def read_hardware_data(self):
@@ -490,7 +498,11 @@ class LltJbd(Battery):
         data = read_serial_data(
             command, self.port, self.baud_rate, self.LENGTH_POS, self.LENGTH_CHECK
         )
-        return self.validate_packet(data)
+        payload = self.validate_packet(data)
+        # a reply was received, but it's invalid
+        if data and payload is False:
+            record_transport_event(self.port, command, "checksum_errors")
+        return payload
 
     def __enter__(self):
         if self.read_serial_data_llt(
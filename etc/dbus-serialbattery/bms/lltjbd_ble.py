@@ -4,8 +4,9 @@ import atexit
 import functools
 import threading
 from asyncio import CancelledError
+from time import monotonic
 from typing import Union, Optional
-from utils import logger
+from utils import logger, record_transport, record_transport_event
 from bleak import BleakClient, BleakScanner, BLEDevice
 from bms.lltjbd import LltJbdProtection, LltJbd
 
@@ -27,7 +28,8 @@ class LltJbd_Ble(LltJbd):
         self.address = address
         self.protection = LltJbdProtection()
         self.type = self.BATTERYTYPE
-        self.main_thread = threading.current_thread()
+        # the bluetooth thread runs until the driver exits, independent of the detection thread
+        self.main_thread = threading.main_thread()
         self.data: bytearray = bytearray()
         self.run = True
         self.bt_thread = threading.Thread(
@@ -145,13 +147,25 @@ class LltJbd_Ble(LltJbd):
         return result
 
     async def async_read_serial_data_llt(self, command):
+        start = monotonic()
         try:
             bt_task = asyncio.run_coroutine_threadsafe(
                 self.send_command(command), self.bt_loop
             )
             result = await asyncio.wait_for(asyncio.wrap_future(bt_task), 20)
+            record_transport(
+                self.port,
+                command,
+                len(command),
+                len(result) if result else 0,
+                monotonic() - start,
+                result is False,
+            )
             return result
         except asyncio.TimeoutError:
+            record_transport(
+                self.port, command, len(command), 0, monotonic() - start, True
+            )
             logger.error(">>> ERROR: No reply - returning")
             return False
         except Exception as e:
@@ -163,7 +177,11 @@ class LltJbd_Ble(LltJbd):
             return False
         try:
             data = asyncio.run(self.async_read_serial_data_llt(command))
-            return self.validate_packet(data)
+            payload = self.validate_packet(data)
+            # a reply was received, but it's invalid
+            if data and payload is False:
+                record_transport_event(self.port, command, "checksum_errors")
+            return payload
         except CancelledError as e:
             logger.error(">>> ERROR: No reply - canceled - returning", e)
             return False
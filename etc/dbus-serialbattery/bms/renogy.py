@@ -18,6 +18,13 @@ class Renogy(Battery):
     LENGTH_CHECK = 4
     LENGTH_POS = 2
 
+    # cell voltages and temperatures are two commands, the temperatures up to three
+    REFRESH_GROUPS = (
+        ("read_soc_data", 0),
+        ("read_cell_data", 2),
+        ("read_temp_data", 5),
+    )
+
     # command bytes [Address field][Function code (03 = Read register)]
     #                   [Register Address (2 bytes)][Data Length (2 bytes)][CRC (2 bytes little endian)]
     command_read = b"\x03"
@@ -71,11 +78,7 @@ class Renogy(Battery):
         # call all functions that will refresh the battery data.
         # This will be called for every iteration (1 second)
         # Return True if success, False for failure
-        result = self.read_soc_data()
-        result = result and self.read_cell_data()
-        result = result and self.read_temp_data()
-
-        return result
+        return self.refresh_groups()
 
     def read_gen_data(self):
         model = self.read_serial_data_renogy(self.command_model)
@@ -1,8 +1,21 @@
 # -*- coding: utf-8 -*-
 from battery import Protection, Battery, Cell
-from utils import logger
+from utils import serial_port_session, logger
+from struct import Struct
 import utils
-import serial
+
+# layouts of the info of the responses, after it was converted from hex ASCII to binary
+# 0x42 telemetry: cell count at byte 2, followed by the cell voltages
+STATUS_CELL_COUNT_OFFSET = 2
+STATUS_CELL_OFFSET = 3
+STATUS_CELL_STRUCT = Struct(">H")
+# 4 cell temperatures, environment and power temperature, current, voltage,
+# remaining capacity, capacity, SOC and cycles
+STATUS_OFFSET = 36
+STATUS_STRUCT = Struct(">6HhHHxHHxxH")
+# 0x44 alarms: voltage, temperature, current, SOC and switch byte
+ALARM_OFFSET = 30
+ALARM_STRUCT = Struct(">BBxBBB")
 
 
 class Seplos(Battery):
@@ -18,28 +31,10 @@ class Seplos(Battery):
     COMMAND_PROTOCOL_VERSION = 0x4F
     COMMAND_VENDOR_INFO = 0x51
 
-    @staticmethod
-    def int_from_1byte_hex_ascii(data: bytes, offset: int, signed=False):
-        return int.from_bytes(
-            bytes.fromhex(data[offset : offset + 2].decode("ascii")),
-            byteorder="big",
-            signed=signed,
-        )
-
-    @staticmethod
-    def int_from_2byte_hex_ascii(data: bytes, offset: int, signed=False):
-        return int.from_bytes(
-            bytes.fromhex(data[offset : offset + 4].decode("ascii")),
-            byteorder="big",
-            signed=signed,
-        )
-
     @staticmethod
     def get_checksum(frame: bytes) -> int:
         """implements the Seplos checksum algorithm, returns 4 bytes"""
-        checksum = 0
-        for b in frame:
-            checksum += b
+        checksum = sum(memoryview(frame))
         checksum %= 0xFFFF
         checksum ^= 0xFFFF
         checksum += 1
@@ -136,12 +131,21 @@ class Seplos(Battery):
         if data is False:
             return False
 
-        logger.debug("alarm info raw {}".format(data))
-        return self.decode_alarm_data(bytes.fromhex(data.decode("ascii")))
+        return self.decode_alarm_data(data)
 
     def decode_alarm_data(self, data: bytes):
-        logger.debug("alarm info decoded {}".format(data))
-        voltage_alarm_byte = data[30]
+        logger.debug("alarm info decoded %s", data)
+        if len(data) < ALARM_OFFSET + ALARM_STRUCT.size:
+            logger.error(">>> ERROR: alarm info too short")
+            return False
+
+        (
+            voltage_alarm_byte,
+            temperature_alarm_byte,
+            current_alarm_byte,
+            soc_alarm_byte,
+            switch_byte,
+        ) = ALARM_STRUCT.unpack_from(data, ALARM_OFFSET)
         self.protection.voltage_cell_low = Seplos.decode_alarm_byte(
             data_byte=voltage_alarm_byte, alarm_bit=3, warn_bit=2
         )
@@ -157,7 +161,6 @@ class Seplos(Battery):
             data_byte=voltage_alarm_byte, alarm_bit=5, warn_bit=4
         )
 
-        temperature_alarm_byte = data[31]
         self.protection.temp_low_charge = Seplos.decode_alarm_byte(
             data_byte=temperature_alarm_byte, alarm_bit=3, warn_bit=2
         )
@@ -171,7 +174,6 @@ class Seplos(Battery):
             data_byte=temperature_alarm_byte, alarm_bit=5, warn_bit=4
         )
 
-        current_alarm_byte = data[33]
         self.protection.current_over = Seplos.decode_alarm_byte(
             data_byte=current_alarm_byte, alarm_bit=1, warn_bit=0
         )
@@ -179,12 +181,10 @@ class Seplos(Battery):
             data_byte=current_alarm_byte, alarm_bit=3, warn_bit=2
         )
 
-        soc_alarm_byte = data[34]
         self.protection.soc_low = Seplos.decode_alarm_byte(
             data_byte=soc_alarm_byte, alarm_bit=3, warn_bit=2
         )
 
-        switch_byte = data[35]
         self.discharge_fet = True if switch_byte & 0b01 != 0 else False
         self.charge_fet = True if switch_byte & 0b10 != 0 else False
         return True
@@ -199,55 +199,62 @@ class Seplos(Battery):
         if data is False:
             return False
 
-        cell_count_offset = 4
-        voltage_offset = 6
-        temps_offset = 72
-        self.cell_count = Seplos.int_from_1byte_hex_ascii(
-            data=data, offset=cell_count_offset
-        )
+        if len(data) < STATUS_OFFSET + STATUS_STRUCT.size:
+            logger.error(">>> ERROR: status info too short")
+            return False
+
+        self.cell_count = data[STATUS_CELL_COUNT_OFFSET]
+        (
+            temp_cell1,
+            temp_cell2,
+            temp_cell3,
+            temp_cell4,
+            temp_environment,
+            temp_power,
+            current,
+            voltage,
+            capacity_remain,
+            capacity,
+            soc,
+            self.cycles,
+        ) = STATUS_STRUCT.unpack_from(data, STATUS_OFFSET)
+
         if self.cell_count == len(self.cells):
-            for i in range(self.cell_count):
-                voltage = (
-                    Seplos.int_from_2byte_hex_ascii(data, voltage_offset + i * 4) / 1000
-                )
-                self.cells[i].voltage = voltage
-                logger.debug("Voltage cell[{}]={}V".format(i, voltage))
-            for i in range(min(4, self.cell_count)):
-                temp = (
-                    Seplos.int_from_2byte_hex_ascii(data, temps_offset + i * 4) - 2731
-                ) / 10
-                self.cells[i].temp = temp
-                logger.debug("Temp cell[{}]={}°C".format(i, temp))
-
-        self.temp1 = (
-            Seplos.int_from_2byte_hex_ascii(data, temps_offset + 4 * 4) - 2731
-        ) / 10
-        self.temp2 = (
-            Seplos.int_from_2byte_hex_ascii(data, temps_offset + 5 * 4) - 2731
-        ) / 10
-        self.current = (
-            Seplos.int_from_2byte_hex_ascii(data, offset=96, signed=True) / 100
-        )
-        self.voltage = Seplos.int_from_2byte_hex_ascii(data, offset=100) / 100
-        self.capacity_remain = Seplos.int_from_2byte_hex_ascii(data, offset=104) / 100
-        self.capacity = Seplos.int_from_2byte_hex_ascii(data, offset=110) / 100
-        self.soc = Seplos.int_from_2byte_hex_ascii(data, offset=114) / 10
-        self.cycles = Seplos.int_from_2byte_hex_ascii(data, offset=122)
+            cell_data = memoryview(data)[
+                STATUS_CELL_OFFSET : STATUS_CELL_OFFSET + 2 * self.cell_count
+            ]
+            self.cells.set_voltages(
+                cell_voltage / 1000
+                for (cell_voltage,) in STATUS_CELL_STRUCT.iter_unpack(cell_data)
+            )
+            temps = (temp_cell1, temp_cell2, temp_cell3, temp_cell4)
+            self.cells.set_temps(
+                (temp - 2731) / 10 for temp in temps[: min(4, self.cell_count)]
+            )
+            logger.debug("Voltage cells=%sV", self.cells.voltages)
+
+        self.temp1 = (temp_environment - 2731) / 10
+        self.temp2 = (temp_power - 2731) / 10
+        self.current = current / 100
+        self.voltage = voltage / 100
+        self.capacity_remain = capacity_remain / 100
+        self.capacity = capacity / 100
+        self.soc = soc / 10
         self.hardware_version = "Seplos BMS {} cells".format(self.cell_count)
 
-        logger.debug("Current = {}A , Voltage = {}V".format(self.current, self.voltage))
+        # the arguments are only formatted, if debug logging is enabled
+        logger.debug("Current = %sA , Voltage = %sV", self.current, self.voltage)
         logger.debug(
-            "Capacity = {}/{}Ah , SOC = {}%".format(
-                self.capacity_remain, self.capacity, self.soc
-            )
+            "Capacity = %s/%sAh , SOC = %s%%",
+            self.capacity_remain,
+            self.capacity,
+            self.soc,
         )
-        logger.debug("Cycles = {}".format(self.cycles))
+        logger.debug("Cycles = %s", self.cycles)
         logger.debug(
-            "Environment temp = {}°C ,  Power temp = {}°C".format(
-                self.temp1, self.temp2
-            )
+            "Environment temp = %s°C ,  Power temp = %s°C", self.temp1, self.temp2
         )
-        logger.debug("HW:" + self.hardware_version)
+        logger.debug("HW:%s", self.hardware_version)
 
         return True
 
@@ -263,8 +270,8 @@ class Seplos(Battery):
             logger.debug("short read, data={}".format(data))
             return False
 
-        chksum = Seplos.get_checksum(data[1:-5])
-        if chksum != Seplos.int_from_2byte_hex_ascii(data, -5):
+        chksum = Seplos.get_checksum(memoryview(data)[1:-5])
+        if chksum != int(data[-5:-1], 16):
             logger.warning("checksum error")
             return False
 
@@ -278,7 +285,7 @@ class Seplos(Battery):
     def read_serial_data_seplos(self, command):
         logger.debug("read serial data seplos")
 
-        with serial.Serial(self.port, baudrate=self.baud_rate, timeout=1) as ser:
+        with serial_port_session(self.port, self.baud_rate, timeout=1) as ser:
             ser.flushOutput()
             ser.flushInput()
             written = ser.write(command)
@@ -295,9 +302,14 @@ class Seplos(Battery):
 
             length_pos = 10
             return_data = data[length_pos + 3 : -5]
-            info_length = Seplos.int_from_2byte_hex_ascii(b"0" + data[length_pos:], 0)
+            info_length = int(data[length_pos : length_pos + 3], 16)
             logger.debug(
                 "return info data of length {} : {}".format(info_length, return_data)
             )
 
-            return return_data
+            # convert the hex ASCII info once, the responses are decoded from the binary data
+            try:
+                return bytes.fromhex(return_data.decode("ascii"))
+            except ValueError:
+                logger.warning("info is not hex ASCII {}".format(return_data))
+                return False
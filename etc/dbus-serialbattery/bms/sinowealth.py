@@ -37,6 +37,19 @@ class Sinowealth(Battery):
     LENGTH_CHECK = 0
     LENGTH_POS = 0
 
+    # each cell voltage is a separate command, cycles and remaining capacity change slowly
+    REFRESH_GROUPS = (
+        ("read_soc", 0),
+        ("read_status_data", 0),
+        ("read_battery_status", 0),
+        ("read_pack_voltage", 0),
+        ("read_pack_current", 0),
+        ("read_cell_data", 2),
+        ("read_temperature_data", 5),
+        ("read_remaining_capacity", 10),
+        ("read_cycle_count", 60),
+    )
+
     def test_connection(self):
         # call a function that will connect to the battery, send a command and retrieve the result.
         # The result or call should be unique to this BMS. Battery name or version, etc.
@@ -73,16 +86,7 @@ class Sinowealth(Battery):
         return True
 
     def refresh_data(self):
-        result = self.read_soc()
-        result = result and self.read_status_data()
-        result = result and self.read_battery_status()
-        result = result and self.read_pack_voltage()
-        result = result and self.read_pack_current()
-        result = result and self.read_cell_data()
-        result = result and self.read_temperature_data()
-        result = result and self.read_remaining_capacity()
-        result = result and self.read_cycle_count()
-        return result
+        return self.refresh_groups()
 
     def read_status_data(self):
         status_data = self.read_serial_data_sinowealth(self.command_status)
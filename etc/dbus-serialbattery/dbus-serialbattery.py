@@ -1,8 +1,11 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
-from typing import Union
+from typing import List, Tuple, Union
 
-from time import sleep
+import importlib
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from time import monotonic, sleep, time
 from dbus.mainloop.glib import DBusGMainLoop
 
 # from threading import Thread  ## removed with https://github.com/Louisvdw/dbus-serialbattery/pull/582
@@ -20,123 +23,305 @@ from dbushelper import DbusHelper
 from utils import logger
 import utils
 from battery import Battery
+from aggregatebattery import AggregateBattery
 
-# import battery classes
-from bms.daly import Daly
-from bms.ecs import Ecs
-from bms.heltecmodbus import HeltecModbus
-from bms.hlpdatabms4s import HLPdataBMS4S
-from bms.jkbms import Jkbms
-from bms.lifepower import Lifepower
-from bms.lltjbd import LltJbd
-from bms.renogy import Renogy
-from bms.seplos import Seplos
-
-# from bms.ant import Ant
-# from bms.mnb import MNB
-# from bms.sinowealth import Sinowealth
+# battery classes and the modules they are defined in
+# the modules are only imported, when the battery is tested, since some of them are large
+# (e.g. the Modbus BMS import minimalmodbus) and every port starts its own driver
+bms_modules = {
+    "Daly": "bms.daly",
+    "Ecs": "bms.ecs",
+    "HeltecModbus": "bms.heltecmodbus",
+    "HLPdataBMS4S": "bms.hlpdatabms4s",
+    "Jkbms": "bms.jkbms",
+    "Lifepower": "bms.lifepower",
+    "LltJbd": "bms.lltjbd",
+    "Renogy": "bms.renogy",
+    "Seplos": "bms.seplos",
+    # "Ant": "bms.ant",
+    # "MNB": "bms.mnb",
+    # "Sinowealth": "bms.sinowealth",
+    # ble classes, the python modules for Bluetooth are only needed for these
+    "Jkbms_Ble": "bms.jkbms_ble",
+    "LltJbd_Ble": "bms.lltjbd_ble",
+}
 
 supported_bms_types = [
-    {"bms": Daly, "baud": 9600, "address": b"\x40"},
-    {"bms": Daly, "baud": 9600, "address": b"\x80"},
-    {"bms": Ecs, "baud": 19200},
-    {"bms": HeltecModbus, "baud": 9600},
-    {"bms": HLPdataBMS4S, "baud": 9600},
-    {"bms": Jkbms, "baud": 115200},
-    {"bms": Lifepower, "baud": 9600},
-    {"bms": LltJbd, "baud": 9600},
-    {"bms": Renogy, "baud": 9600, "address": b"\x30"},
-    {"bms": Renogy, "baud": 9600, "address": b"\xF7"},
-    {"bms": Seplos, "baud": 19200},
-    # {"bms": Ant, "baud": 19200},
-    # {"bms": MNB, "baud": 9600},
-    # {"bms": Sinowealth},
+    {"bms": "Daly", "baud": 9600, "address": b"\x40"},
+    {"bms": "Daly", "baud": 9600, "address": b"\x80"},
+    # "slow": the test takes long, if no BMS answers (e.g. Modbus retries)
+    {"bms": "Ecs", "baud": 19200, "slow": True},
+    {"bms": "HeltecModbus", "baud": 9600, "slow": True},
+    {"bms": "HLPdataBMS4S", "baud": 9600},
+    {"bms": "Jkbms", "baud": 115200},
+    {"bms": "Lifepower", "baud": 9600},
+    {"bms": "LltJbd", "baud": 9600},
+    {"bms": "Renogy", "baud": 9600, "address": b"\x30"},
+    {"bms": "Renogy", "baud": 9600, "address": b"\xF7"},
+    {"bms": "Seplos", "baud": 19200},
+    # {"bms": "Ant", "baud": 19200},
+    # {"bms": "MNB", "baud": 9600},
+    # {"bms": "Sinowealth"},
 ]
 expected_bms_types = [
     battery_type
     for battery_type in supported_bms_types
-    if battery_type["bms"].__name__ == utils.BMS_TYPE or utils.BMS_TYPE == ""
+    if battery_type["bms"] == utils.BMS_TYPE or utils.BMS_TYPE == ""
 ]
 
+
+def get_bms_class(name: str) -> type:
+    """
+    Imports the module of the battery class on first use and returns the class
+    """
+    return getattr(importlib.import_module(bms_modules[name]), name)
+
+
+def get_probe_order(bms_types):
+    """
+    Groups the BMS types by baud rate, so that the line settings only change once per group,
+    and tests the fast ones of each group first
+    """
+    groups = {}
+    for battery_type in bms_types:
+        groups.setdefault(battery_type["baud"], []).append(battery_type)
+    return [
+        battery_type
+        for group in groups.values()
+        for battery_type in sorted(group, key=lambda t: t.get("slow", False))
+    ]
+
+
+probe_order = get_probe_order(expected_bms_types)
+
 print("")
 logger.info("Starting dbus-serialbattery")
 
 
 def main():
-    def poll_battery(loop):
-        helper.publish_battery(loop)
-        return True
+    def poll_battery(helper, loop):
+        helper.record_poll()
+
+        if helper.io_worker is None:
+            helper.publish_battery(loop)
+            if helper.stopped:
+                battery_stopped(helper)
+                return False
+            poll_interval = helper.get_poll_interval()
+
+        # read the BMS in the I/O worker, so that the main loop never waits for I/O
+        # skip this poll, if the BMS is still busy with the last one
+        else:
+            if not helper.start_refresh(
+                lambda future, _helper=helper: gobject.idle_add(
+                    battery_refreshed, _helper, future, loop
+                )
+            ):
+                helper.overruns += 1
+                logger.debug(
+                    "Poll skipped, last refresh of %s still running",
+                    helper.battery.port,
+                )
+            poll_interval = helper.poll_interval
+
+        schedule_battery(
+            helper, loop, poll_interval, helper.poll_deadline + poll_interval / 1000
+        )
+        return False
+
+    def battery_refreshed(helper, future, loop):
+        helper.publish_refreshed_battery(future, loop)
+        if helper.stopped:
+            gobject.source_remove(helper.poll_timer)
+            battery_stopped(helper)
+            return False
+
+        # re-arm the timer, if the battery has to be polled at another interval
+        poll_interval = helper.get_poll_interval()
+        if poll_interval != helper.poll_interval:
+            gobject.source_remove(helper.poll_timer)
+            schedule_battery(
+                helper,
+                loop,
+                poll_interval,
+                helper.poll_deadline + (poll_interval - helper.poll_interval) / 1000,
+            )
+        return False
+
+    def battery_stopped(helper):
+        """
+        Called after the poll timer of a failed battery was removed. The driver only exits,
+        if no battery is polled anymore, so that one failed battery doesn't stop the others.
+        """
+        helper.poll_timer = None
+        if all(_helper.stopped for _helper in helpers):
+            logger.error("ERROR >>> No battery is polled anymore, exiting")
+            mainloop.quit()
+
+    def schedule_battery(helper, loop, poll_interval, deadline=None):
+        """
+        Arms the poll timer for the deadline (time.monotonic()). The deadlines are absolute, so
+        that a slow poll doesn't delay the following ones. If deadlines were missed, they are
+        coalesced to one poll, which runs immediately, and counted as overruns.
+        """
+        now = monotonic()
+        if deadline is None:
+            deadline = now + poll_interval / 1000
+        elif deadline < now:
+            missed = int((now - deadline) / (poll_interval / 1000))
+            helper.overruns += missed
+            deadline += missed * poll_interval / 1000
+
+        helper.poll_interval = poll_interval
+        helper.poll_deadline = deadline
+        helper.poll_timer = gobject.timeout_add(
+            max(0, round((deadline - now) * 1000)),
+            lambda _helper=helper: poll_battery(_helper, loop),
+        )
+
+    def get_cached_battery(_port, deadline) -> Union[Battery, None]:
+        # try the BMS first, that was found on this port the last time
+        cached = utils.get_detected_bms(_port)
+        if cached is None:
+            return None
+
+        for test in expected_bms_types:
+            address = test.get("address")
+            if (
+                test["bms"] != cached.get("bms")
+                or test["baud"] != cached.get("baud")
+                or (address.hex() if address is not None else None)
+                != cached.get("address")
+            ):
+                continue
+
+            # noinspection PyBroadException
+            try:
+                logger.info("Testing " + test["bms"] + " (last detected)")
+                # the serial reads of the probe don't wait beyond the detection deadline
+                utils.set_detection_deadline(deadline)
+                battery: Battery = get_bms_class(test["bms"])(
+                    port=_port, baud=test["baud"], address=address
+                )
+                if battery.test_connection():
+                    return battery
+            except KeyboardInterrupt:
+                raise
+            except Exception:
+                pass
+            finally:
+                utils.set_detection_deadline(None)
+            break
+
+        logger.info("Last detected BMS not found, testing all BMS types")
+        return None
+
+    def get_battery(_port, deadline) -> Union[Battery, None]:
+        try:
+            battery = get_cached_battery(_port, deadline)
+        except KeyboardInterrupt:
+            return None
+        if battery is not None:
+            logger.info("Connection established to " + battery.__class__.__name__)
+            return battery
 
-    def get_battery(_port) -> Union[Battery, None]:
         # all the different batteries the driver support and need to test for
         # try to establish communications with the battery 3 times, else exit
+        # stop earlier, if the detection deadline is reached
+        detection_start = time()
         count = 3
         while count > 0:
             # create a new battery object that can read the battery and run connection test
-            for test in expected_bms_types:
+            for test in probe_order:
+                if monotonic() > deadline:
+                    logger.error(
+                        "BMS detection timeout of %ss reached on %s"
+                        % (utils.BMS_DETECTION_TIMEOUT, _port)
+                    )
+                    return None
+
+                test_start = time()
                 # noinspection PyBroadException
                 try:
-                    logger.info("Testing " + test["bms"].__name__)
-                    batteryClass = test["bms"]
+                    logger.info("Testing " + test["bms"] + " on " + _port)
+                    # the serial reads of the probe don't wait beyond the detection deadline
+                    utils.set_detection_deadline(deadline)
+                    batteryClass = get_bms_class(test["bms"])
                     baud = test["baud"]
                     battery: Battery = batteryClass(
                         port=_port, baud=baud, address=test.get("address")
                     )
                     if battery.test_connection():
                         logger.info(
-                            "Connection established to " + battery.__class__.__name__
+                            "Connection established to "
+                            + battery.__class__.__name__
+                            + " on "
+                            + _port
+                            + " (%.2fs, detection took %.2fs)"
+                            % (time() - test_start, time() - detection_start)
+                        )
+                        utils.save_detected_bms(
+                            _port, batteryClass.__name__, baud, test.get("address")
                         )
                         return battery
                 except KeyboardInterrupt:
                     return None
+                except ImportError as e:
+                    logger.error("Could not import " + test["bms"] + ": " + str(e))
                 except Exception:
                     # Ignore any malfunction test_function()
                     pass
+                finally:
+                    utils.set_detection_deadline(None)
+                logger.info("No %s found (%.2fs)" % (test["bms"], time() - test_start))
             count -= 1
             sleep(0.5)
 
+        logger.info(
+            "BMS detection on %s took %.2fs" % (_port, time() - detection_start)
+        )
         return None
 
-    def get_port() -> str:
-        # Get the port we need to use from the argument
-        if len(sys.argv) > 1:
-            return sys.argv[1]
-        else:
+    def get_ports() -> List[Tuple[str, Union[str, None]]]:
+        """
+        Get the ports we need to use from the arguments.
+        Multiple ports can be passed to poll several batteries in one process, e.g.
+        /dev/ttyUSB0 /dev/ttyUSB1 Jkbms_Ble C8:47:8C:00:00:00
+        A Bluetooth BMS type is always followed by its address.
+        """
+        ports = []
+        args = sys.argv[1:]
+        i = 0
+        while i < len(args):
+            if args[i].endswith("_Ble") and i + 1 < len(args):
+                ports.append((args[i], args[i + 1]))
+                i += 2
+            else:
+                ports.append((args[i], None))
+                i += 1
+
+        if len(ports) == 0:
             # just for MNB-SPI
             logger.info("No Port needed")
-            return "/dev/tty/USB9"
+            ports.append(("/dev/tty/USB9", None))
 
-    logger.info("dbus-serialbattery v" + str(utils.DRIVER_VERSION))
+        return ports
 
-    port = get_port()
-    battery = None
-    if port.endswith("_Ble") and len(sys.argv) > 2:
+    def get_ble_battery(_port, _address) -> Union[Battery, None]:
         """
-        Import ble classes only, if it's a ble port, else the driver won't start due to missing python modules
-        This prevent problems when using the driver only with a serial connection
+        The ble classes are only imported, if it's a ble port, else the driver won't start due to missing
+        python modules. This prevent problems when using the driver only with a serial connection
         """
-        if port == "Jkbms_Ble":
-            # noqa: F401 --> ignore flake "imported but unused" error
-            from bms.jkbms_ble import Jkbms_Ble  # noqa: F401
-
-        if port == "LltJbd_Ble":
-            # noqa: F401 --> ignore flake "imported but unused" error
-            from bms.lltjbd_ble import LltJbd_Ble  # noqa: F401
-
-        class_ = eval(port)
-        testbms = class_("", 9600, sys.argv[2])
+        testbms = get_bms_class(_port)("", 9600, _address)
         if testbms.test_connection() is True:
             logger.info("Connection established to " + testbms.__class__.__name__)
-            battery = testbms
-    else:
-        battery = get_battery(port)
+            return testbms
+
+        return None
 
-    # exit if no battery could be found
-    if battery is None:
-        logger.error("ERROR >>> No battery connection at " + port)
-        sys.exit(1)
+    logger.info("dbus-serialbattery v" + str(utils.DRIVER_VERSION))
 
-    battery.log_settings()
+    ports = get_ports()
 
     # Have a mainloop, so we can send/receive asynchronous calls to and from dbus
     DBusGMainLoop(set_as_default=True)
@@ -144,20 +329,121 @@ def main():
         gobject.threads_init()
     mainloop = gobject.MainLoop()
 
-    # Get the initial values for the battery used by setup_vedbus
-    helper = DbusHelper(battery)
+    # combine parallel batteries to one virtual battery, which is the only one controlling DVCC
+    aggregate = utils.AGGREGATE_BATTERIES and len(ports) > 1
+
+    batteries: List[Battery] = []
+    helpers: List[DbusHelper] = []
+    pending_ports = set(ports)
+    exit_code = [0]
+
+    def start_battery(
+        battery: Battery,
+        publish_limits: bool,
+        io_thread: bool = True,
+        take_snapshots: bool = False,
+    ) -> bool:
+        """
+        Publish the battery on dbus and poll it at its INTERVAL
+        """
+        helper = DbusHelper(
+            battery,
+            publish_limits=publish_limits,
+            io_thread=io_thread,
+            take_snapshots=take_snapshots,
+        )
 
-    if not helper.setup_vedbus():
-        logger.error("ERROR >>> Problem with battery set up at " + port)
-        sys.exit(1)
+        if not helper.setup_vedbus():
+            logger.error("ERROR >>> Problem with battery set up at " + battery.port)
+            return False
+
+        helper.battery.log_settings()
+        helpers.append(helper)
+        schedule_battery(helper, mainloop, helper.battery.poll_interval)
+        return True
+
+    def stop(code: int) -> None:
+        exit_code[0] = code
+        mainloop.quit()
+
+    def detection_finished() -> None:
+        # exit if no battery could be found
+        if len(batteries) == 0:
+            stop(1)
+            return
+
+        # the aggregate battery doesn't wait for I/O, it's refreshed in the main loop
+        if aggregate and not start_battery(
+            AggregateBattery(batteries), True, io_thread=False
+        ):
+            stop(1)
+
+    def battery_found(_port: str, battery: Union[Battery, None]) -> None:
+        # skip ports where no battery could be found
+        if battery is None:
+            logger.error("ERROR >>> No battery connection at " + _port)
+        # only the packs of an aggregate battery need snapshots of their values
+        elif start_battery(battery, not aggregate, take_snapshots=aggregate):
+            batteries.append(battery)
+        else:
+            stop(1)
+
+    def battery_detected(
+        port_address: Tuple[str, Union[str, None]], future: Future
+    ) -> bool:
+        """
+        Called in the main loop, when the detection on a port has finished
+        """
+        pending_ports.discard(port_address)
+        _port = port_address[0]
+        if future.exception() is not None:
+            logger.error(
+                "ERROR >>> Detection failed at %s: %s" % (_port, future.exception())
+            )
+            battery_found(_port, None)
+        else:
+            battery_found(_port, future.result())
+
+        if len(pending_ports) == 0:
+            detection_finished()
+        return False
+
+    # detect the batteries on all ports concurrently, one worker per port, so that
+    # each battery is published as soon as it's found and not after the slowest port finished
+    deadline = monotonic() + utils.BMS_DETECTION_TIMEOUT
+    executor = ThreadPoolExecutor(
+        max_workers=len(ports), thread_name_prefix="detection"
+    )
+    for port, address in ports:
+        if address is None:
+            future = executor.submit(get_battery, port, deadline)
+        else:
+            future = executor.submit(get_ble_battery, port, address)
+        future.add_done_callback(
+            lambda _future, _port=(port, address): gobject.idle_add(
+                battery_detected, _port, _future
+            )
+        )
+    executor.shutdown(wait=False)
+
+    # log a summary of the requests to the BMS periodically
+    if utils.LOG_TRANSPORT_STATS_EVERY > 0:
+        gobject.timeout_add_seconds(
+            utils.LOG_TRANSPORT_STATS_EVERY, utils.log_transport_stats
+        )
+
+    # the main loop can't be stopped, before it's running
+    if exit_code[0] != 0:
+        sys.exit(exit_code[0])
 
-    # Poll the battery at INTERVAL and run the main loop
-    gobject.timeout_add(battery.poll_interval, lambda: poll_battery(mainloop))
     try:
         mainloop.run()
     except KeyboardInterrupt:
         pass
 
+    if exit_code[0] != 0:
+        sys.exit(exit_code[0])
+
 
 if __name__ == "__main__":
     main()
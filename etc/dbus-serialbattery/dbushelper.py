@@ -4,7 +4,10 @@ import os
 import platform
 import dbus
 import traceback
-from time import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from time import monotonic, time
+from typing import Dict, Iterable
 
 # Victron packages
 sys.path.insert(
@@ -16,21 +19,142 @@ sys.path.insert(
 )
 from vedbus import VeDbusService  # noqa: E402
 from settingsdevice import SettingsDevice  # noqa: E402
-from utils import logger, publish_config_variables  # noqa: E402
+from utils import (  # noqa: E402
+    logger,
+    publish_config_variables,
+    get_serial_port_stats,
+    get_transport_stats,
+)
 import utils  # noqa: E402
 
 
-def get_bus():
+def get_bus(private=False):
     return (
-        dbus.SessionBus()
+        dbus.SessionBus(private=private)
         if "DBUS_SESSION_BUS_ADDRESS" in os.environ
-        else dbus.SystemBus()
+        else dbus.SystemBus(private=private)
     )
 
 
 class DbusHelper:
-    def __init__(self, battery):
+    # values are only published, if they changed more than the deadband since the last publish
+    DEADBANDS = {
+        "/Soc": 0.1,
+        "/Dc/0/Voltage": 0.01,
+        "/Dc/0/Current": 0.1,
+        "/Dc/0/Power": 1,
+        "/Dc/0/Temperature": 0.1,
+        "/Dc/0/MidVoltage": 0.01,
+        "/Dc/0/MidVoltageDeviation": 0.1,
+        "/Capacity": 0.01,
+        "/ConsumedAmphours": 0.01,
+        "/History/TotalAhDrawn": 0.01,
+        "/System/MinCellTemperature": 0.1,
+        "/System/MaxCellTemperature": 0.1,
+        "/System/MOSTemperature": 0.1,
+        "/System/Temperature1": 0.1,
+        "/System/Temperature2": 0.1,
+        "/System/Temperature3": 0.1,
+        "/System/Temperature4": 0.1,
+        "/System/MinCellVoltage": 0.001,
+        "/System/MaxCellVoltage": 0.001,
+        "/Debug/CycleTime": 10,
+        "/Debug/PollDelay": 10,
+        "/Debug/RefreshLatencyP50": 10,
+        "/Debug/RefreshLatencyP95": 10,
+        "/Debug/RefreshLatencyP99": 10,
+    }
+
+    # totals of the requests to the BMS, see utils.TransportStats
+    TRANSPORT_PATHS = (
+        ("/Debug/Transport/Requests", "requests"),
+        ("/Debug/Transport/BytesOut", "bytes_out"),
+        ("/Debug/Transport/BytesIn", "bytes_in"),
+        ("/Debug/Transport/Timeouts", "timeouts"),
+        ("/Debug/Transport/ChecksumErrors", "checksum_errors"),
+        ("/Debug/Transport/Retries", "retries"),
+        ("/Debug/Transport/UnchangedFrames", "unchanged_frames"),
+    )
+
+    # number of refreshes, the latency percentiles are calculated from
+    LATENCY_WINDOW = 100
+
+    # paths that are published directly from a battery attribute
+    ATTRIBUTE_PATHS = (
+        ("/System/NrOfCellsPerBattery", "cell_count"),
+        ("/History/ChargeCycles", "cycles"),
+        ("/History/TotalAhDrawn", "total_ah_drawn"),
+        ("/System/Temperature1", "temp1"),
+        ("/System/Temperature2", "temp2"),
+        ("/System/Temperature3", "temp3"),
+        ("/System/Temperature4", "temp4"),
+        ("/Info/ChargeMode", "charge_mode"),
+        ("/Info/ChargeLimitation", "charge_limitation"),
+        ("/Info/DischargeLimitation", "discharge_limitation"),
+    )
+
+    # paths that are published from the battery protection attributes
+    ALARM_PATHS = (
+        ("/Alarms/LowVoltage", "voltage_low"),
+        ("/Alarms/LowCellVoltage", "voltage_cell_low"),
+        ("/Alarms/HighVoltage", "voltage_high"),
+        ("/Alarms/LowSoc", "soc_low"),
+        ("/Alarms/HighChargeCurrent", "current_over"),
+        ("/Alarms/HighDischargeCurrent", "current_under"),
+        ("/Alarms/CellImbalance", "cell_imbalance"),
+        ("/Alarms/InternalFailure", "internal_failure"),
+        ("/Alarms/HighChargeTemperature", "temp_high_charge"),
+        ("/Alarms/LowChargeTemperature", "temp_low_charge"),
+        ("/Alarms/HighTemperature", "temp_high_discharge"),
+        ("/Alarms/LowTemperature", "temp_low_discharge"),
+        ("/Alarms/HighInternalTemperature", "temp_high_internal"),
+    )
+
+    def __init__(
+        self, battery, publish_limits=True, io_thread=True, take_snapshots=False
+    ):
         self.battery = battery
+        # if True, the blocking BMS I/O of each poll runs in a worker thread, see start_refresh()
+        self.io_worker = (
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix="io")
+            if io_thread
+            else None
+        )
+        self.refresh_running = False
+        # set by stop(), the battery is not polled anymore
+        self.stopped = False
+        # interval in ms, id and deadline (time.monotonic()) of the poll timer
+        self.poll_interval = battery.poll_interval
+        self.poll_timer = None
+        self.poll_deadline = None
+        # poll timing in ms, see record_poll() and refresh_battery()
+        self.poll_last_start = None
+        self.cycle_time = None
+        self.poll_delay = None
+        self.overruns = 0
+        self.refresh_latencies = deque(maxlen=self.LATENCY_WINDOW)
+        # if False, no charge/discharge limits are published, so that the battery
+        # does not control DVCC (e.g. when an aggregate battery is published)
+        self.publish_limits = publish_limits
+        # if True, a snapshot of the battery is taken after each poll for the aggregate battery,
+        # see update_snapshot()
+        self.take_snapshots = take_snapshots
+        # last published values and deadbands per path, see set_value()
+        self.published_values = {}
+        self.deadbands = dict(self.DEADBANDS)
+        self.full_refresh = True
+        self.full_refresh_last = 0
+        # charge control values of the last poll and the number of polls, whose battery values
+        # were not published, since neither the BMS data nor the charge control changed
+        self.control_last = None
+        self.skipped_publishes = 0
+        # publish plan, which is compiled once in setup_vedbus()
+        self.getter_paths = ()
+        self.cell_voltage_paths = ()
+        self.cell_balance_paths = ()
+        self.cell_sum_path = None
+        self.cell_diff_path = None
+        self.time_to_soc_paths = ()
         self.instance = 1
         self.settings = None
         self.error_count = 0
@@ -38,8 +162,12 @@ class DbusHelper:
         self._dbusservice = VeDbusService(
             "com.victronenergy.battery."
             + self.battery.port[self.battery.port.rfind("/") + 1 :],
-            get_bus(),
+            # each service needs its own connection, if several batteries are
+            # handled by the same process
+            get_bus(private=True),
         )
+        # target of set_value(), the service context while a poll is published
+        self.dbus_target = self._dbusservice
 
     def setup_instance(self):
         # bms_id = self.battery.production if self.battery.production is not None else \
@@ -138,19 +266,19 @@ class DbusHelper:
         )
         self._dbusservice.add_path(
             "/Info/MaxChargeVoltage",
-            self.battery.max_battery_voltage,
+            self.battery.max_battery_voltage if self.publish_limits else None,
             writeable=True,
             gettextcallback=lambda p, v: "{:0.2f}V".format(v),
         )
         self._dbusservice.add_path(
             "/Info/MaxChargeCurrent",
-            self.battery.max_battery_charge_current,
+            self.battery.max_battery_charge_current if self.publish_limits else None,
             writeable=True,
             gettextcallback=lambda p, v: "{:0.2f}A".format(v),
         )
         self._dbusservice.add_path(
             "/Info/MaxDischargeCurrent",
-            self.battery.max_battery_discharge_current,
+            self.battery.max_battery_discharge_current if self.publish_limits else None,
             writeable=True,
             gettextcallback=lambda p, v: "{:0.2f}A".format(v),
         )
@@ -296,35 +424,46 @@ class DbusHelper:
 
         # cell voltages
         if utils.BATTERY_CELL_DATA_FORMAT > 0:
-            for i in range(1, self.battery.cell_count + 1):
-                cellpath = (
-                    "/Cell/%s/Volts"
-                    if (utils.BATTERY_CELL_DATA_FORMAT & 2)
-                    else "/Voltages/Cell%s"
+            cellpath = (
+                "/Cell/%s/Volts"
+                if (utils.BATTERY_CELL_DATA_FORMAT & 2)
+                else "/Voltages/Cell%s"
+            )
+            self.cell_voltage_paths = tuple(
+                cellpath % (str(i)) for i in range(1, self.battery.cell_count + 1)
+            )
+            if utils.BATTERY_CELL_DATA_FORMAT & 1:
+                self.cell_balance_paths = tuple(
+                    "/Balances/Cell%s" % (str(i))
+                    for i in range(1, self.battery.cell_count + 1)
                 )
+            for path in self.cell_voltage_paths:
                 self._dbusservice.add_path(
-                    cellpath % (str(i)),
+                    path,
                     None,
                     writeable=True,
                     gettextcallback=lambda p, v: "{:0.3f}V".format(v),
                 )
-                if utils.BATTERY_CELL_DATA_FORMAT & 1:
-                    self._dbusservice.add_path(
-                        "/Balances/Cell%s" % (str(i)), None, writeable=True
-                    )
+                self.deadbands[path] = 0.001
+            for path in self.cell_balance_paths:
+                self._dbusservice.add_path(path, None, writeable=True)
             pathbase = "Cell" if (utils.BATTERY_CELL_DATA_FORMAT & 2) else "Voltages"
+            self.cell_sum_path = "/%s/Sum" % pathbase
+            self.cell_diff_path = "/%s/Diff" % pathbase
             self._dbusservice.add_path(
-                "/%s/Sum" % pathbase,
+                self.cell_sum_path,
                 None,
                 writeable=True,
                 gettextcallback=lambda p, v: "{:2.2f}V".format(v),
             )
             self._dbusservice.add_path(
-                "/%s/Diff" % pathbase,
+                self.cell_diff_path,
                 None,
                 writeable=True,
                 gettextcallback=lambda p, v: "{:0.3f}V".format(v),
             )
+            self.deadbands[self.cell_sum_path] = 0.01
+            self.deadbands[self.cell_diff_path] = 0.001
 
         # Create TimeToSoC items only if enabled
         if self.battery.capacity is not None:
@@ -334,10 +473,43 @@ class DbusHelper:
 
             # Create TimeToSoc items
             if len(utils.TIME_TO_SOC_POINTS) > 0:
-                for num in utils.TIME_TO_SOC_POINTS:
-                    self._dbusservice.add_path(
-                        "/TimeToSoC/" + str(num), None, writeable=True
-                    )
+                self.time_to_soc_paths = tuple(
+                    (num, "/TimeToSoC/" + str(num)) for num in utils.TIME_TO_SOC_POINTS
+                )
+                for _, path in self.time_to_soc_paths:
+                    self._dbusservice.add_path(path, None, writeable=True)
+
+        # Create debug items
+        self._dbusservice.add_path("/Debug/SerialPortOpened", None, writeable=True)
+        self._dbusservice.add_path("/Debug/SerialPortClosed", None, writeable=True)
+        self._dbusservice.add_path("/Debug/CycleTime", None, writeable=True)
+        self._dbusservice.add_path("/Debug/PollDelay", None, writeable=True)
+        self._dbusservice.add_path("/Debug/Overruns", None, writeable=True)
+        self._dbusservice.add_path("/Debug/SkippedPublishes", None, writeable=True)
+        self._dbusservice.add_path("/Debug/RefreshLatencyP50", None, writeable=True)
+        self._dbusservice.add_path("/Debug/RefreshLatencyP95", None, writeable=True)
+        self._dbusservice.add_path("/Debug/RefreshLatencyP99", None, writeable=True)
+        for path, _ in self.TRANSPORT_PATHS:
+            self._dbusservice.add_path(path, None, writeable=True)
+        self._dbusservice.add_path(
+            "/Debug/Transport/LatencyHistogram", None, writeable=True
+        )
+
+        # paths that are published directly from a battery method
+        self.getter_paths = (
+            ("/Dc/0/Temperature", self.battery.get_temp),
+            ("/Capacity", self.battery.get_capacity_remain),
+            ("/System/MinCellTemperature", self.battery.get_min_temp),
+            ("/System/MinTemperatureCellId", self.battery.get_min_temp_id),
+            ("/System/MaxCellTemperature", self.battery.get_max_temp),
+            ("/System/MaxTemperatureCellId", self.battery.get_max_temp_id),
+            ("/System/MOSTemperature", self.battery.get_mos_temp),
+            ("/System/MinVoltageCellId", self.battery.get_min_cell_desc),
+            ("/System/MaxVoltageCellId", self.battery.get_max_cell_desc),
+            ("/System/MinCellVoltage", self.battery.get_min_cell_voltage),
+            ("/System/MaxCellVoltage", self.battery.get_max_cell_voltage),
+            ("/Balancing", self.battery.get_balancing),
+        )
 
         logger.info(f"publish config values = {utils.PUBLISH_CONFIG_VALUES}")
         if utils.PUBLISH_CONFIG_VALUES == 1:
@@ -352,13 +524,88 @@ class DbusHelper:
                 onchangecallback=self.battery.reset_soc_callback,
             )
 
+        # the I/O worker is not running yet, the first snapshot can be taken here
+        self.update_snapshot()
+        return True
+
+    def update_snapshot(self) -> None:
+        """
+        Publishes the values of the last poll for readers in the main loop, see Battery.get_snapshot().
+        Copying the battery is skipped, if there is no aggregate battery reading the snapshot.
+        """
+        if self.take_snapshots:
+            self.battery.snapshot = self.battery.get_snapshot()
+
+    def refresh_battery(self) -> bool:
+        """
+        Reads the data from the BMS. This is the only part of a poll, that waits for I/O
+        """
+        self.battery.cell_stats = None
+        self.battery.refresh_changed = None
+        start = monotonic()
+        try:
+            return self.battery.refresh_data()
+        finally:
+            self.refresh_latencies.append(round((monotonic() - start) * 1000))
+
+    def record_poll(self) -> None:
+        """
+        Records the start of a poll, which was due at poll_deadline
+        """
+        now = monotonic()
+        if self.poll_last_start is not None:
+            self.cycle_time = round((now - self.poll_last_start) * 1000)
+        self.poll_last_start = now
+        self.poll_delay = round((now - self.poll_deadline) * 1000)
+
+    def get_refresh_latencies(self, percentiles: Iterable[int]) -> Dict[int, int]:
+        """
+        Returns the refresh latency in ms for each percentile of the last LATENCY_WINDOW refreshes
+        """
+        latencies = sorted(self.refresh_latencies)
+        if not latencies:
+            return {percentile: None for percentile in percentiles}
+        return {
+            percentile: latencies[
+                min(len(latencies) - 1, len(latencies) * percentile // 100)
+            ]
+            for percentile in percentiles
+        }
+
+    def start_refresh(self, callback) -> bool:
+        """
+        Starts refresh_battery() in the I/O worker thread and calls callback(future) from the
+        worker thread, when it finished. The battery belongs to the worker, until the main loop
+        handed the future to publish_refreshed_battery(), therefore no new refresh is started
+        before. Returns False, if the last refresh is still running.
+        """
+        if self.refresh_running:
+            return False
+
+        self.refresh_running = True
+        self.io_worker.submit(self.refresh_battery).add_done_callback(callback)
         return True
 
-    def publish_battery(self, loop):
+    def publish_refreshed_battery(self, future: Future, loop) -> None:
+        """
+        Publishes the data read by start_refresh(). Called in the main loop
+        """
+        self.refresh_running = False
+        error = future.exception()
+        if error is not None:
+            traceback.print_exception(type(error), error, error.__traceback__)
+            self.stop()
+            return
+
+        self.publish_battery(loop, future.result())
+
+    def publish_battery(self, loop, success=None):
         # This is called every battery.poll_interval milli second as set up per battery type to read and update the data
         try:
-            # Call the battery's refresh_data function
-            success = self.battery.refresh_data()
+            online = self.error_count == 0
+            # Call the battery's refresh_data function, if it was not already called by the I/O worker
+            if success is None:
+                success = self.refresh_battery()
             if success:
                 self.error_count = 0
                 self.battery.online = True
@@ -380,7 +627,11 @@ class DbusHelper:
 
                 # Has it completely failed
                 if self.error_count >= 60:
-                    loop.quit()
+                    self.stop()
+                    return
+
+            # Take one snapshot of the cell statistics for all consumers of this poll
+            self.battery.update_cell_stats()
 
             # This is to mannage CVCL
             self.battery.manage_charge_voltage()
@@ -388,187 +639,238 @@ class DbusHelper:
             # This is to mannage CCL\DCL
             self.battery.manage_charge_current()
 
+            # The charge control depends on timers, therefore it's managed on every poll, but the
+            # battery values only have to be published, if the BMS sent new data
+            control = self.get_charge_control()
+            unchanged = (
+                success
+                and online
+                and self.battery.refresh_changed is False
+                and control == self.control_last
+                and not self.is_full_refresh_due()
+            )
+            self.control_last = control
+            if unchanged:
+                self.skipped_publishes += 1
+
             # publish all the data from the battery object to dbus
-            self.publish_dbus()
+            self.publish_dbus(values=not unchanged)
 
+            self.update_snapshot()
+
+        except Exception:
+            traceback.print_exc()
+            self.stop()
+
+    def stop(self) -> None:
+        """
+        Stops polling this battery, after it failed completely. The battery is published as
+        disconnected, while the other batteries of the process keep running. The caller has to
+        remove the poll timer, see stopped.
+        """
+        logger.error(
+            "ERROR >>> Battery at " + self.battery.port + " failed, stop polling"
+        )
+        self.stopped = True
+        self.battery.online = False
+        self.battery.init_values()
+        if utils.BLOCK_ON_DISCONNECT:
+            self.block_because_disconnect = True
+        self.update_snapshot()
+        try:
+            self.publish_dbus()
+            self._dbusservice["/Connected"] = 0
         except Exception:
             traceback.print_exc()
-            loop.quit()
+        if self.io_worker is not None:
+            self.io_worker.shutdown(wait=False)
+
+    def get_poll_interval(self) -> int:
+        """
+        Returns the interval in ms until the next poll
+        """
+        # poll at the interval of the driver, while the battery doesn't answer,
+        # so that a lost connection is detected after the usual number of polls
+        if self.error_count > 0:
+            return self.battery.poll_interval
+        return self.battery.get_poll_interval()
+
+    def get_charge_control(self) -> tuple:
+        """
+        Returns the values set by manage_charge_voltage() and manage_charge_current()
+        """
+        battery = self.battery
+        return (
+            battery.control_voltage,
+            battery.control_charge_current,
+            battery.control_discharge_current,
+            battery.control_allow_charge,
+            battery.control_allow_discharge,
+            battery.charge_mode,
+            battery.charge_limitation,
+            battery.discharge_limitation,
+        )
+
+    def is_full_refresh_due(self) -> bool:
+        # Publish all values again every PUBLISH_FULL_REFRESH_EVERY seconds, else only changed values
+        return (
+            utils.PUBLISH_FULL_REFRESH_EVERY == 0
+            or int(time()) - self.full_refresh_last >= utils.PUBLISH_FULL_REFRESH_EVERY
+        )
+
+    def set_value(self, path, value):
+        """
+        Publishes the value to the dbus, if it changed more than the deadband of the path since
+        it was published the last time or if a full refresh is due
+        """
+        if not self.full_refresh and path in self.published_values:
+            last = self.published_values[path]
+            if value == last and type(value) is type(last):
+                return
+            deadband = self.deadbands.get(path)
+            if (
+                deadband is not None
+                and isinstance(value, (int, float))
+                and isinstance(last, (int, float))
+                and abs(value - last) < deadband
+            ):
+                return
+
+        self.published_values[path] = value
+        self.dbus_target[path] = value
+
+    def publish_dbus(self, values=True):
+        """
+        Publishes the battery values, if values is set, and the debug values
+        """
+        # Newer velib versions collect all changes made within the service context and emit
+        # them as one ItemsChanged signal instead of one PropertiesChanged signal per path
+        if hasattr(VeDbusService, "__enter__"):
+            with self._dbusservice as context:
+                self.dbus_target = context
+                try:
+                    if values:
+                        self.publish_dbus_values()
+                    self.publish_dbus_debug_values()
+                finally:
+                    self.dbus_target = self._dbusservice
+        else:
+            if values:
+                self.publish_dbus_values()
+            self.publish_dbus_debug_values()
+
+    def publish_dbus_values(self):
+        self.full_refresh = self.is_full_refresh_due()
+        if self.full_refresh:
+            self.full_refresh_last = int(time())
+
+        # Update values from the publish plan
+        for path, getter in self.getter_paths:
+            self.set_value(path, getter())
+        for path, name in self.ATTRIBUTE_PATHS:
+            self.set_value(path, getattr(self.battery, name))
+        protection = self.battery.protection
+        for path, name in self.ALARM_PATHS:
+            self.set_value(path, getattr(protection, name))
 
-    def publish_dbus(self):
         # Update SOC, DC and System items
-        self._dbusservice["/System/NrOfCellsPerBattery"] = self.battery.cell_count
-        self._dbusservice["/Soc"] = (
-            round(self.battery.soc, 2) if self.battery.soc is not None else None
+        self.set_value(
+            "/Soc", round(self.battery.soc, 2) if self.battery.soc is not None else None
         )
-        self._dbusservice["/Dc/0/Voltage"] = (
-            round(self.battery.voltage, 2) if self.battery.voltage is not None else None
+        self.set_value(
+            "/Dc/0/Voltage",
+            round(self.battery.voltage, 2)
+            if self.battery.voltage is not None
+            else None,
         )
-        self._dbusservice["/Dc/0/Current"] = (
-            round(self.battery.current, 2) if self.battery.current is not None else None
+        self.set_value(
+            "/Dc/0/Current",
+            round(self.battery.current, 2)
+            if self.battery.current is not None
+            else None,
         )
-        self._dbusservice["/Dc/0/Power"] = (
+        self.set_value(
+            "/Dc/0/Power",
             round(self.battery.voltage * self.battery.current, 2)
             if self.battery.current is not None and self.battery.current is not None
-            else None
+            else None,
         )
-        self._dbusservice["/Dc/0/Temperature"] = self.battery.get_temp()
-        self._dbusservice["/Capacity"] = self.battery.get_capacity_remain()
-        self._dbusservice["/ConsumedAmphours"] = (
+        self.set_value(
+            "/ConsumedAmphours",
             None
             if self.battery.capacity is None
             or self.battery.get_capacity_remain() is None
-            else self.battery.capacity - self.battery.get_capacity_remain()
+            else self.battery.capacity - self.battery.get_capacity_remain(),
         )
 
         midpoint, deviation = self.battery.get_midvoltage()
         if midpoint is not None:
-            self._dbusservice["/Dc/0/MidVoltage"] = midpoint
-            self._dbusservice["/Dc/0/MidVoltageDeviation"] = deviation
+            self.set_value("/Dc/0/MidVoltage", midpoint)
+            self.set_value("/Dc/0/MidVoltageDeviation", deviation)
 
         # Update battery extras
-        self._dbusservice["/History/ChargeCycles"] = self.battery.cycles
-        self._dbusservice["/History/TotalAhDrawn"] = self.battery.total_ah_drawn
-        self._dbusservice["/Io/AllowToCharge"] = (
+        self.set_value(
+            "/Io/AllowToCharge",
             1
             if self.battery.charge_fet
             and self.battery.control_allow_charge
             and self.block_because_disconnect is False
-            else 0
+            else 0,
         )
-        self._dbusservice["/Io/AllowToDischarge"] = (
+        self.set_value(
+            "/Io/AllowToDischarge",
             1
             if self.battery.discharge_fet
             and self.battery.control_allow_discharge
             and self.block_because_disconnect is False
-            else 0
+            else 0,
         )
-        self._dbusservice["/Io/AllowToBalance"] = 1 if self.battery.balance_fet else 0
-        self._dbusservice["/System/NrOfModulesBlockingCharge"] = (
+        self.set_value("/Io/AllowToBalance", 1 if self.battery.balance_fet else 0)
+        self.set_value(
+            "/System/NrOfModulesBlockingCharge",
             0
             if (
                 self.battery.charge_fet is None
                 or (self.battery.charge_fet and self.battery.control_allow_charge)
             )
             and self.block_because_disconnect is False
-            else 1
+            else 1,
         )
-        self._dbusservice["/System/NrOfModulesBlockingDischarge"] = (
+        self.set_value(
+            "/System/NrOfModulesBlockingDischarge",
             0
             if (self.battery.discharge_fet is None or self.battery.discharge_fet)
             and self.block_because_disconnect is False
-            else 1
-        )
-        self._dbusservice["/System/NrOfModulesOnline"] = 1 if self.battery.online else 0
-        self._dbusservice["/System/NrOfModulesOffline"] = (
-            0 if self.battery.online else 1
-        )
-        self._dbusservice["/System/MinCellTemperature"] = self.battery.get_min_temp()
-        self._dbusservice[
-            "/System/MinTemperatureCellId"
-        ] = self.battery.get_min_temp_id()
-        self._dbusservice["/System/MaxCellTemperature"] = self.battery.get_max_temp()
-        self._dbusservice[
-            "/System/MaxTemperatureCellId"
-        ] = self.battery.get_max_temp_id()
-        self._dbusservice["/System/MOSTemperature"] = self.battery.get_mos_temp()
-        self._dbusservice["/System/Temperature1"] = self.battery.temp1
-        self._dbusservice["/System/Temperature2"] = self.battery.temp2
-        self._dbusservice["/System/Temperature3"] = self.battery.temp3
-        self._dbusservice["/System/Temperature4"] = self.battery.temp4
-
-        # Voltage control
-        self._dbusservice["/Info/MaxChargeVoltage"] = self.battery.control_voltage
-
-        # Charge control
-        self._dbusservice[
-            "/Info/MaxChargeCurrent"
-        ] = self.battery.control_charge_current
-        self._dbusservice[
-            "/Info/MaxDischargeCurrent"
-        ] = self.battery.control_discharge_current
-
-        # Voltage and charge control info
-        self._dbusservice["/Info/ChargeMode"] = self.battery.charge_mode
-        self._dbusservice["/Info/ChargeLimitation"] = self.battery.charge_limitation
-        self._dbusservice[
-            "/Info/DischargeLimitation"
-        ] = self.battery.discharge_limitation
-
-        # Updates from cells
-        self._dbusservice["/System/MinVoltageCellId"] = self.battery.get_min_cell_desc()
-        self._dbusservice["/System/MaxVoltageCellId"] = self.battery.get_max_cell_desc()
-        self._dbusservice[
-            "/System/MinCellVoltage"
-        ] = self.battery.get_min_cell_voltage()
-        self._dbusservice[
-            "/System/MaxCellVoltage"
-        ] = self.battery.get_max_cell_voltage()
-        self._dbusservice["/Balancing"] = self.battery.get_balancing()
-
-        # Update the alarms
-        self._dbusservice["/Alarms/LowVoltage"] = self.battery.protection.voltage_low
-        self._dbusservice[
-            "/Alarms/LowCellVoltage"
-        ] = self.battery.protection.voltage_cell_low
-        self._dbusservice["/Alarms/HighVoltage"] = self.battery.protection.voltage_high
-        self._dbusservice["/Alarms/LowSoc"] = self.battery.protection.soc_low
-        self._dbusservice[
-            "/Alarms/HighChargeCurrent"
-        ] = self.battery.protection.current_over
-        self._dbusservice[
-            "/Alarms/HighDischargeCurrent"
-        ] = self.battery.protection.current_under
-        self._dbusservice[
-            "/Alarms/CellImbalance"
-        ] = self.battery.protection.cell_imbalance
-        self._dbusservice[
-            "/Alarms/InternalFailure"
-        ] = self.battery.protection.internal_failure
-        self._dbusservice[
-            "/Alarms/HighChargeTemperature"
-        ] = self.battery.protection.temp_high_charge
-        self._dbusservice[
-            "/Alarms/LowChargeTemperature"
-        ] = self.battery.protection.temp_low_charge
-        self._dbusservice[
-            "/Alarms/HighTemperature"
-        ] = self.battery.protection.temp_high_discharge
-        self._dbusservice[
-            "/Alarms/LowTemperature"
-        ] = self.battery.protection.temp_low_discharge
-        self._dbusservice["/Alarms/BmsCable"] = (
-            2 if self.block_because_disconnect else 0
-        )
-        self._dbusservice[
-            "/Alarms/HighInternalTemperature"
-        ] = self.battery.protection.temp_high_internal
+            else 1,
+        )
+        self.set_value("/System/NrOfModulesOnline", 1 if self.battery.online else 0)
+        self.set_value("/System/NrOfModulesOffline", 0 if self.battery.online else 1)
+
+        if self.publish_limits:
+            # Voltage control
+            self.set_value("/Info/MaxChargeVoltage", self.battery.control_voltage)
+
+            # Charge control
+            self.set_value(
+                "/Info/MaxChargeCurrent", self.battery.control_charge_current
+            )
+            self.set_value(
+                "/Info/MaxDischargeCurrent", self.battery.control_discharge_current
+            )
+
+        self.set_value("/Alarms/BmsCable", 2 if self.block_because_disconnect else 0)
 
         # cell voltages
-        if utils.BATTERY_CELL_DATA_FORMAT > 0:
+        if self.cell_voltage_paths:
             try:
-                voltageSum = 0
-                for i in range(self.battery.cell_count):
-                    voltage = self.battery.get_cell_voltage(i)
-                    cellpath = (
-                        "/Cell/%s/Volts"
-                        if (utils.BATTERY_CELL_DATA_FORMAT & 2)
-                        else "/Voltages/Cell%s"
-                    )
-                    self._dbusservice[cellpath % (str(i + 1))] = voltage
-                    if utils.BATTERY_CELL_DATA_FORMAT & 1:
-                        self._dbusservice[
-                            "/Balances/Cell%s" % (str(i + 1))
-                        ] = self.battery.get_cell_balancing(i)
-                    if voltage:
-                        voltageSum += voltage
-                pathbase = (
-                    "Cell" if (utils.BATTERY_CELL_DATA_FORMAT & 2) else "Voltages"
-                )
-                self._dbusservice["/%s/Sum" % pathbase] = voltageSum
-                self._dbusservice["/%s/Diff" % pathbase] = (
-                    self.battery.get_max_cell_voltage()
-                    - self.battery.get_min_cell_voltage()
+                stats = self.battery.get_cell_stats()
+                for i, path in enumerate(self.cell_voltage_paths):
+                    self.set_value(path, self.battery.get_cell_voltage(i))
+                for i, path in enumerate(self.cell_balance_paths):
+                    self.set_value(path, self.battery.get_cell_balancing(i))
+                self.set_value(self.cell_sum_path, stats.voltage_sum)
+                self.set_value(
+                    self.cell_diff_path, stats.max_voltage - stats.min_voltage
                 )
             except Exception:
                 pass
@@ -577,7 +879,7 @@ class DbusHelper:
         try:
             if (
                 self.battery.capacity is not None
-                and (utils.TIME_TO_GO_ENABLE or len(utils.TIME_TO_SOC_POINTS) > 0)
+                and (utils.TIME_TO_GO_ENABLE or len(self.time_to_soc_paths) > 0)
                 and (
                     int(time()) - self.battery.time_to_soc_update
                     >= utils.TIME_TO_SOC_RECALCULATE_EVERY
@@ -591,7 +893,8 @@ class DbusHelper:
                 # Update TimeToGo item
                 if utils.TIME_TO_GO_ENABLE:
                     # Update TimeToGo item, has to be a positive int since it's used from dbus-systemcalc-py
-                    self._dbusservice["/TimeToGo"] = (
+                    self.set_value(
+                        "/TimeToGo",
                         abs(
                             int(
                                 self.battery.get_timeToSoc(
@@ -600,17 +903,17 @@ class DbusHelper:
                             )
                         )
                         if self.battery.current
-                        else None
+                        else None,
                     )
 
                 # Update TimeToSoc items
-                if len(utils.TIME_TO_SOC_POINTS) > 0:
-                    for num in utils.TIME_TO_SOC_POINTS:
-                        self._dbusservice["/TimeToSoC/" + str(num)] = (
-                            self.battery.get_timeToSoc(num, crntPrctPerSec)
-                            if self.battery.current
-                            else None
-                        )
+                for num, path in self.time_to_soc_paths:
+                    self.set_value(
+                        path,
+                        self.battery.get_timeToSoc(num, crntPrctPerSec)
+                        if self.battery.current
+                        else None,
+                    )
 
         except Exception:
             pass
@@ -619,5 +922,25 @@ class DbusHelper:
             logger.debug("logged to dbus [%s]" % str(round(self.battery.soc, 2)))
             self.battery.log_cell_data()
 
+    def publish_dbus_debug_values(self):
+        # Update debug items
+        serial_port_stats = get_serial_port_stats(self.battery.port)
+        self.set_value("/Debug/SerialPortOpened", serial_port_stats["opened"])
+        self.set_value("/Debug/SerialPortClosed", serial_port_stats["closed"])
+        self.set_value("/Debug/CycleTime", self.cycle_time)
+        self.set_value("/Debug/PollDelay", self.poll_delay)
+        self.set_value("/Debug/Overruns", self.overruns)
+        for percentile, latency in self.get_refresh_latencies((50, 95, 99)).items():
+            self.set_value("/Debug/RefreshLatencyP" + str(percentile), latency)
+        transport_stats = get_transport_stats(self.battery.port)
+        for path, name in self.TRANSPORT_PATHS:
+            self.set_value(path, getattr(transport_stats, name))
+        self.set_value(
+            "/Debug/Transport/LatencyHistogram",
+            transport_stats.get_latency_histogram(),
+        )
+        self.set_value("/Debug/SkippedPublishes", self.skipped_publishes)
+
+        # set from the dbus, therefore independent of the BMS data
         if self.battery.has_settings:
-            self._dbusservice["/Settings/ResetSoc"] = self.battery.reset_soc
+            self.dbus_target["/Settings/ResetSoc"] = self.battery.reset_soc
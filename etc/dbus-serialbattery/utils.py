@@ -2,11 +2,18 @@
 import logging
 
 import configparser
+from contextlib import contextmanager
 from pathlib import Path
-from typing import List, Any, Callable
+from typing import List, Any, Callable, Dict, Union
 
+import hashlib
+import io
+import json
+import os
+import select
 import serial
-from time import sleep
+import threading
+from time import monotonic
 from struct import unpack_from
 import bisect
 
@@ -31,6 +38,94 @@ def _get_list_from_config(
     )
 
 
+class LimitCurve:
+    """
+    Limit curve with setpoints (e.g. cell voltage, temperature or SoC) and the matching output values.
+    The setpoints are sorted ascending and the slopes are calculated once, when the config is loaded.
+    If a resolution is passed and all setpoints are a multiple of it, the step values are additionally
+    stored in a lookup table.
+    """
+
+    def __init__(self, inArray, outArray, resolution=None):
+        if len(inArray) > 0 and inArray[0] > inArray[-1]:  # change compare-direction
+            inArray = inArray[::-1]
+            outArray = outArray[::-1]
+        self.inputs = tuple(inArray)
+        self.outputs = tuple(outArray)
+        self.slopes = tuple(
+            (self.outputs[i + 1] - self.outputs[i])
+            / (self.inputs[i + 1] - self.inputs[i])
+            if self.inputs[i + 1] != self.inputs[i]
+            else 0
+            for i in range(len(self.inputs) - 1)
+        )
+        self.resolution = None
+        self.step_tables = None
+        if resolution is not None and len(self.inputs) > 1:
+            self._build_step_tables(resolution)
+
+    def _build_step_tables(self, resolution) -> None:
+        steps = [(value - self.inputs[0]) / resolution for value in self.inputs]
+        # the lookup table is only exact, if all setpoints are on the grid
+        if any(abs(step - round(step)) > 1e-9 for step in steps):
+            return
+        self.resolution = resolution
+        self.step_tables = {
+            return_lower: tuple(
+                self._step(self.inputs[0] + (i + 0.5) * resolution, return_lower)
+                for i in range(round(steps[-1]))
+            )
+            for return_lower in (False, True)
+        }
+
+    def linear(self, inValue):
+        inputs = self.inputs
+        # Handle out of bounds
+        if inValue <= inputs[0]:
+            return self.outputs[0]
+        if inValue >= inputs[-1]:
+            return self.outputs[-1]
+
+        # else calculate linear current between the setpoints
+        idx = bisect.bisect(inputs, inValue) - 1
+        return constrain(
+            self.outputs[idx] + (inValue - inputs[idx]) * self.slopes[idx],
+            self.outputs[idx],
+            self.outputs[idx + 1],
+        )
+
+    def step(self, inValue, returnLower):
+        inputs = self.inputs
+        # Handle out of bounds
+        if inValue <= inputs[0]:
+            return self.outputs[0]
+        if inValue >= inputs[-1]:
+            return self.outputs[-1]
+
+        if self.step_tables is not None:
+            position = (inValue - inputs[0]) / self.resolution
+            idx = int(position)
+            table = self.step_tables[returnLower]
+            # values close to the bucket boundaries (the setpoints) are looked up exactly,
+            # since the division can round them into the neighbour bucket
+            if idx < len(table) and 1e-9 < position - idx < 1 - 1e-9:
+                return table[idx]
+        return self._step(inValue, returnLower)
+
+    def _step(self, inValue, returnLower):
+        # get index between the setpoints
+        idx = bisect.bisect(self.inputs, inValue)
+        return self.outputs[idx] if returnLower else self.outputs[idx - 1]
+
+    def get(self, inValue, returnLower):
+        """
+        Returns the linear or step value depending on LINEAR_LIMITATION_ENABLE
+        """
+        if LINEAR_LIMITATION_ENABLE:
+            return self.linear(inValue)
+        return self.step(inValue, returnLower)
+
+
 # battery types
 # if not specified: baud = 9600
 
@@ -61,6 +156,14 @@ FLOAT_CELL_VOLTAGE = float(config["DEFAULT"]["FLOAT_CELL_VOLTAGE"])
 #       again or the driver/system is restarted
 BLOCK_ON_DISCONNECT = "True" == config["DEFAULT"]["BLOCK_ON_DISCONNECT"]
 
+# --------- Aggregate batteries ---------
+# Description: If multiple batteries are connected to the same driver process, then publish an additional
+#              virtual battery (com.victronenergy.battery.aggregate) that combines all packs. The aggregate
+#              battery is the only one that publishes charge/discharge limits, so that it controls DVCC.
+# False: Each battery is published on its own and sets its own limits
+# True: An aggregate battery is published in addition to the single batteries
+AGGREGATE_BATTERIES = "True" == config["DEFAULT"]["AGGREGATE_BATTERIES"]
+
 # --------- Charge mode ---------
 # Choose the mode for voltage / current limitations (True / False)
 # False is a step mode: This is the default with limitations on hard boundary steps
@@ -155,6 +258,13 @@ MAX_DISCHARGE_CURRENT_CV = _get_list_from_config(
     lambda v: MAX_BATTERY_DISCHARGE_CURRENT * float(v),
 )
 
+MAX_CHARGE_CURRENT_CV_CURVE = LimitCurve(
+    CELL_VOLTAGES_WHILE_CHARGING, MAX_CHARGE_CURRENT_CV
+)
+MAX_DISCHARGE_CURRENT_CV_CURVE = LimitCurve(
+    CELL_VOLTAGES_WHILE_DISCHARGING, MAX_DISCHARGE_CURRENT_CV
+)
+
 
 # --------- Temperature limitation (affecting CCL/DCL) ---------
 # Description: Maximal charge / discharge current will be in-/decreased depending on temperature
@@ -185,6 +295,14 @@ MAX_DISCHARGE_CURRENT_T = _get_list_from_config(
     lambda v: MAX_BATTERY_DISCHARGE_CURRENT * float(v),
 )
 
+# temperature steps are usually full degrees, which allows a lookup table in step mode
+MAX_CHARGE_CURRENT_T_CURVE = LimitCurve(
+    TEMPERATURE_LIMITS_WHILE_CHARGING, MAX_CHARGE_CURRENT_T, 1
+)
+MAX_DISCHARGE_CURRENT_T_CURVE = LimitCurve(
+    TEMPERATURE_LIMITS_WHILE_DISCHARGING, MAX_DISCHARGE_CURRENT_T, 1
+)
+
 
 # --------- SOC limitation (affecting CCL/DCL) ---------
 # Description: Maximal charge / discharge current will be increased / decreased depending on State of Charge,
@@ -227,6 +345,25 @@ DC_CURRENT_LIMIT3 = MAX_BATTERY_DISCHARGE_CURRENT * float(
     config["DEFAULT"]["DC_CURRENT_LIMIT3_FRACTION"]
 )
 
+MAX_CHARGE_CURRENT_SOC_CURVE = LimitCurve(
+    [100, CC_SOC_LIMIT1, CC_SOC_LIMIT2, CC_SOC_LIMIT3],
+    [
+        CC_CURRENT_LIMIT1,
+        CC_CURRENT_LIMIT2,
+        CC_CURRENT_LIMIT3,
+        MAX_BATTERY_CHARGE_CURRENT,
+    ],
+)
+MAX_DISCHARGE_CURRENT_SOC_CURVE = LimitCurve(
+    [DC_SOC_LIMIT3, DC_SOC_LIMIT2, DC_SOC_LIMIT1],
+    [
+        MAX_BATTERY_DISCHARGE_CURRENT,
+        DC_CURRENT_LIMIT3,
+        DC_CURRENT_LIMIT2,
+        DC_CURRENT_LIMIT1,
+    ],
+)
+
 
 # --------- Time-To-Go ---------
 # Description: Calculates the time to go shown in the GUI
@@ -272,9 +409,33 @@ TIME_TO_SOC_INC_FROM = "True" == config["DEFAULT"]["TIME_TO_SOC_INC_FROM"]
 # Ant, MNB, Sinowealth
 BMS_TYPE = config["DEFAULT"]["BMS_TYPE"]
 
+# Specify in seconds how long the driver tries to find a BMS on a port, before it gives up
+BMS_DETECTION_TIMEOUT = float(config["DEFAULT"]["BMS_DETECTION_TIMEOUT"])
+
 # Publish the config settings to the dbus path "/Info/Config/"
 PUBLISH_CONFIG_VALUES = int(config["DEFAULT"]["PUBLISH_CONFIG_VALUES"])
 
+# Only publish values to the dbus, if they changed more than a small deadband (e.g. 1 mV cell voltage,
+# 0.1 A current). Specify in seconds how often all values are published again, regardless of a change
+# 0: Publish all values on every poll
+PUBLISH_FULL_REFRESH_EVERY = int(config["DEFAULT"]["PUBLISH_FULL_REFRESH_EVERY"])
+
+# Adapt the poll interval to the battery dynamics (True/False)
+# The battery is polled every POLL_INTERVAL_MIN ms (but not faster than the BMS driver polls), while the
+# current is flowing, the current, the cell voltage difference or CCL/DCL are changing or a warning/alarm
+# is active. While the battery is idle, the interval is doubled on every poll up to POLL_INTERVAL_MAX ms,
+# also if the battery is full or empty
+POLL_INTERVAL_ADAPTIVE = "True" == config["DEFAULT"]["POLL_INTERVAL_ADAPTIVE"]
+POLL_INTERVAL_MIN = int(config["DEFAULT"]["POLL_INTERVAL_MIN"])
+POLL_INTERVAL_MAX = int(config["DEFAULT"]["POLL_INTERVAL_MAX"])
+# Current in A, below which the battery is idle
+POLL_IDLE_CURRENT = float(config["DEFAULT"]["POLL_IDLE_CURRENT"])
+
+# Log a summary of the requests sent to the BMS per command (count, bytes, latency, timeouts, checksum
+# errors and retries) every x seconds. The totals are published to the dbus path "/Debug/Transport/"
+# 0: Disabled
+LOG_TRANSPORT_STATS_EVERY = int(config["DEFAULT"]["LOG_TRANSPORT_STATS_EVERY"])
+
 # Select the format of cell data presented on dbus [Valid values 0,1,2,3]
 # 0 Do not publish all the cells (only the min/max cell data as used by the default GX)
 # 1 Format: /Voltages/Cell (also available for display on Remote Console)
@@ -362,38 +523,13 @@ def mapRangeConstrain(inValue, inMin, inMax, outMin, outMax):
 
 
 def calcLinearRelationship(inValue, inArray, outArray):
-    if inArray[0] > inArray[-1]:  # change compare-direction in array
-        return calcLinearRelationship(inValue, inArray[::-1], outArray[::-1])
-    else:
-        # Handle out of bounds
-        if inValue <= inArray[0]:
-            return outArray[0]
-        if inValue >= inArray[-1]:
-            return outArray[-1]
-
-        # else calculate linear current between the setpoints
-        idx = bisect.bisect(inArray, inValue)
-        upperIN = inArray[idx - 1]  # begin with idx 0 as max value
-        upperOUT = outArray[idx - 1]
-        lowerIN = inArray[idx]
-        lowerOUT = outArray[idx]
-        return mapRangeConstrain(inValue, lowerIN, upperIN, lowerOUT, upperOUT)
+    # kept for compatibility, the limits use the LimitCurve objects created on config load
+    return LimitCurve(inArray, outArray).linear(inValue)
 
 
 def calcStepRelationship(inValue, inArray, outArray, returnLower):
-    if inArray[0] > inArray[-1]:  # change compare-direction in array
-        return calcStepRelationship(inValue, inArray[::-1], outArray[::-1], returnLower)
-
-    # Handle out of bounds
-    if inValue <= inArray[0]:
-        return outArray[0]
-    if inValue >= inArray[-1]:
-        return outArray[-1]
-
-    # else get index between the setpoints
-    idx = bisect.bisect(inArray, inValue)
-
-    return outArray[idx] if returnLower else outArray[idx - 1]
+    # kept for compatibility, the limits use the LimitCurve objects created on config load
+    return LimitCurve(inArray, outArray).step(inValue, returnLower)
 
 
 def is_bit_set(tmp):
@@ -414,11 +550,405 @@ def format_value(value, prefix, suffix):
     )
 
 
+# --------- BMS detection cache ---------
+# The BMS found on a port is stored, so that it can be tried first on the next start
+detection_cache_file_path = path.joinpath("detection_cache.json").absolute().__str__()
+# the detection threads of several ports may save their results at the same time
+detection_cache_lock = threading.Lock()
+
+
+def get_port_id(port) -> str:
+    """
+    Returns the persistent /dev/serial/by-id path of the port, which doesn't change
+    if the USB adapter gets another ttyUSB number. If there is none, the port is returned.
+    """
+    try:
+        real_port = os.path.realpath(port)
+        for link in sorted(Path("/dev/serial/by-id").iterdir()):
+            if os.path.realpath(link) == real_port:
+                return str(link)
+    except OSError:
+        pass
+    return port
+
+
+def load_detection_cache() -> Dict[str, Dict[str, Any]]:
+    try:
+        with open(detection_cache_file_path, "r") as file:
+            cache = json.load(file)
+        return cache if isinstance(cache, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def get_detected_bms(port) -> Union[Dict[str, Any], None]:
+    """
+    Returns the BMS type, baud rate and address (as hex string or None) that was
+    detected on this port the last time
+    """
+    return load_detection_cache().get(get_port_id(port))
+
+
+def save_detected_bms(port, bms_type, baud, address) -> None:
+    port_id = get_port_id(port)
+    entry = {
+        "bms": bms_type,
+        "baud": baud,
+        "address": address.hex() if address is not None else None,
+    }
+    with detection_cache_lock:
+        cache = load_detection_cache()
+        if cache.get(port_id) == entry:
+            return
+
+        cache[port_id] = entry
+        try:
+            # write to a temporary file first, so that the cache is never left half written
+            tmp_file_path = detection_cache_file_path + ".tmp"
+            with open(tmp_file_path, "w") as file:
+                json.dump(cache, file, indent=2)
+            os.replace(tmp_file_path, detection_cache_file_path)
+        except OSError as e:
+            logger.warning(f"Could not save the detected BMS: {e}")
+
+
+# --------- Serial port sessions ---------
+# One long-lived connection per port that is shared by all drivers. The port is only
+# closed and reopened, if a SerialException occurs.
+serial_ports: Dict[str, serial.Serial] = {}
+serial_port_locks: Dict[str, threading.RLock] = {}
+serial_port_stats: Dict[str, Dict[str, int]] = {}
+serial_ports_lock = threading.Lock()
+# deadline (time.monotonic()) of the BMS detection running in the current thread, so that
+# a probe of a BMS type can't wait for replies beyond the detection timeout
+detection_deadline = threading.local()
+
+
+def set_detection_deadline(deadline: Union[float, None]) -> None:
+    """
+    Limits all serial reads of the current thread to the deadline (time.monotonic()).
+    None removes the limit, after the detection finished.
+    """
+    detection_deadline.value = deadline
+
+
+def get_detection_remaining(timeout: float) -> float:
+    """
+    Returns the timeout reduced to the time remaining until the detection deadline.
+    A timeout of None (blocking) is limited as well.
+    """
+    deadline = getattr(detection_deadline, "value", None)
+    if deadline is None:
+        return timeout
+    remaining = max(0, deadline - monotonic())
+    return remaining if timeout is None else min(timeout, remaining)
+
+
+def get_serial_port_stats(port) -> Dict[str, int]:
+    """
+    Returns how often the port was opened and closed since the driver was started
+    """
+    return serial_port_stats.get(port, {"opened": 0, "closed": 0})
+
+
+def get_serial_port(port, baud, timeout=0.1) -> serial.Serial:
+    """
+    Returns the already opened serial port or opens it, if it's not open yet.
+    Baud rate and timeout are only changed, if they differ from the current line settings.
+    """
+    ser = serial_ports.get(port)
+    if ser is None or not ser.is_open:
+        ser = serial.Serial(port, baudrate=baud, timeout=timeout)
+        serial_ports[port] = ser
+        stats = serial_port_stats.setdefault(port, {"opened": 0, "closed": 0})
+        stats["opened"] += 1
+        if stats["opened"] > 1:
+            logger.info(f"Serial port {port} reopened ({stats['opened']} times)")
+        return ser
+
+    if ser.baudrate != baud:
+        ser.baudrate = baud
+    if ser.timeout != timeout:
+        ser.timeout = timeout
+    return ser
+
+
+def close_serial_port(port) -> None:
+    ser = serial_ports.pop(port, None)
+    if ser is None:
+        return
+    try:
+        ser.close()
+    except Exception:
+        pass
+    serial_port_stats.setdefault(port, {"opened": 0, "closed": 0})["closed"] += 1
+
+
+def get_serial_port_lock(port) -> threading.RLock:
+    """
+    Returns the lock of the port, which is held during one exchange with the BMS
+    """
+    with serial_ports_lock:
+        return serial_port_locks.setdefault(port, threading.RLock())
+
+
+@contextmanager
+def serial_port_session(port, baud, timeout=0.1):
+    """
+    Locks the shared serial port for one exchange and yields it.
+    On a SerialException the port is closed, so that it's reopened on the next request.
+    """
+    with get_serial_port_lock(port):
+        try:
+            yield get_serial_port(port, baud, get_detection_remaining(timeout))
+        except serial.SerialException:
+            close_serial_port(port)
+            raise
+
+
+# --------- Transport statistics ---------
+# Requests to the BMS are recorded per port and command, so that bad cabling (timeouts,
+# checksum errors) can be told apart from a slow BMS (high latency)
+# upper bounds in ms of the latency histogram buckets, the last bucket takes all slower requests
+TRANSPORT_LATENCY_BUCKETS = (10, 25, 50, 100, 250, 500, 1000)
+
+
+class TransportStats:
+    """
+    This class holds the statistics of the requests of one command or the totals of a port
+    """
+
+    EVENTS = ("timeouts", "checksum_errors", "retries", "unchanged_frames")
+
+    def __init__(self):
+        self.requests = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.timeouts = 0
+        self.checksum_errors = 0
+        self.retries = 0
+        # replies that were not parsed, since they were the same as the last one
+        self.unchanged_frames = 0
+        self.latency_histogram = [0] * (len(TRANSPORT_LATENCY_BUCKETS) + 1)
+
+    def add(self, other: "TransportStats") -> None:
+        self.requests += other.requests
+        self.bytes_out += other.bytes_out
+        self.bytes_in += other.bytes_in
+        for event in self.EVENTS:
+            setattr(self, event, getattr(self, event) + getattr(other, event))
+        for index, count in enumerate(other.latency_histogram):
+            self.latency_histogram[index] += count
+
+    def get_latency_histogram(self) -> str:
+        """
+        Returns the latency histogram as string, e.g. "<=10ms:5 <=25ms:2 >1000ms:1"
+        """
+        labels = ["<=" + str(bucket) + "ms" for bucket in TRANSPORT_LATENCY_BUCKETS]
+        labels.append(">" + str(TRANSPORT_LATENCY_BUCKETS[-1]) + "ms")
+        return " ".join(
+            label + ":" + str(count)
+            for label, count in zip(labels, self.latency_histogram)
+            if count
+        )
+
+    def __str__(self) -> str:
+        return (
+            f"requests: {self.requests} | out: {self.bytes_out}B | in: {self.bytes_in}B"
+            + f" | timeouts: {self.timeouts} | checksum errors: {self.checksum_errors}"
+            + f" | retries: {self.retries} | unchanged: {self.unchanged_frames}"
+            + f" | latency: {self.get_latency_histogram()}"
+        )
+
+
+transport_stats: Dict[str, Dict[str, TransportStats]] = {}
+transport_stats_lock = threading.Lock()
+
+
+def get_transport_command_key(command) -> str:
+    """
+    Returns the key of a command, which are the first 8 bytes as hex for binary commands
+    """
+    if isinstance(command, (bytes, bytearray, memoryview)):
+        return bytes(command[:8]).hex()
+    return str(command)
+
+
+def get_command_transport_stats(port, command) -> TransportStats:
+    # has to be called with transport_stats_lock
+    commands = transport_stats.setdefault(port, {})
+    key = get_transport_command_key(command)
+    stats = commands.get(key)
+    if stats is None:
+        stats = commands[key] = TransportStats()
+    return stats
+
+
+def record_transport(
+    port, command, bytes_out: int, bytes_in: int, latency: float, timeout=False
+) -> None:
+    """
+    Records a request with its latency in seconds. If timeout is set, the reply was missing
+    or incomplete.
+    """
+    latency_ms = latency * 1000
+    bucket = bisect.bisect_left(TRANSPORT_LATENCY_BUCKETS, latency_ms)
+    with transport_stats_lock:
+        stats = get_command_transport_stats(port, command)
+        stats.requests += 1
+        stats.bytes_out += bytes_out
+        stats.bytes_in += bytes_in
+        stats.latency_histogram[bucket] += 1
+        if timeout:
+            stats.timeouts += 1
+
+
+def record_transport_event(port, command, event: str) -> None:
+    """
+    Records an event of a request, see TransportStats.EVENTS
+    """
+    with transport_stats_lock:
+        stats = get_command_transport_stats(port, command)
+        setattr(stats, event, getattr(stats, event) + 1)
+
+
+def get_transport_stats(port) -> TransportStats:
+    """
+    Returns the totals of all commands of the port
+    """
+    totals = TransportStats()
+    with transport_stats_lock:
+        for stats in transport_stats.get(port, {}).values():
+            totals.add(stats)
+    return totals
+
+
+def log_transport_stats() -> bool:
+    """
+    Logs the statistics of each port and command
+    """
+    with transport_stats_lock:
+        lines = [
+            f"{port} {command}: {stats}"
+            for port, commands in transport_stats.items()
+            for command, stats in commands.items()
+        ]
+    logger.info("========== Transport statistics ==========")
+    for line in lines:
+        logger.info(line)
+    return True
+
+
+# digest of the last parsed reply per port and command, see is_frame_unchanged()
+frame_digests: Dict[str, Dict[Any, bytes]] = {}
+
+
+def get_frame_digest_key(command):
+    # the whole command is the key, since commands may only differ after the first 8 bytes
+    return bytes(command) if isinstance(command, (bytes, bytearray)) else command
+
+
+def is_frame_unchanged(port, command, data) -> bool:
+    """
+    Returns True, if the reply is byte-identical to the last reply of the command on this port,
+    that was saved with save_frame_digest(). The drivers can skip parsing it then, since it
+    would set the same values again.
+    """
+    digest = hashlib.blake2b(data, digest_size=16).digest()
+    with transport_stats_lock:
+        unchanged = (
+            frame_digests.get(port, {}).get(get_frame_digest_key(command)) == digest
+        )
+        if unchanged:
+            get_command_transport_stats(port, command).unchanged_frames += 1
+    return unchanged
+
+
+def save_frame_digest(port, command, data) -> None:
+    """
+    Saves the digest of a reply, after it was parsed successfully. A reply that failed to
+    parse is never saved, so that an identical reply is parsed (and fails) again.
+    """
+    digest = hashlib.blake2b(data, digest_size=16).digest()
+    with transport_stats_lock:
+        frame_digests.setdefault(port, {})[get_frame_digest_key(command)] = digest
+
+
+def clear_frame_digests(port) -> None:
+    """
+    Forgets the last replies of the port, so that the next replies are parsed again
+    """
+    with transport_stats_lock:
+        frame_digests.pop(port, None)
+
+
+def instrument_modbus(instrument, port):
+    """
+    Records the transport statistics of all requests of a minimalmodbus.Instrument
+    """
+    communicate = instrument._communicate
+    perform_command = instrument._perform_command
+    # bytes sent and received by the last request
+    exchange = [0, 0]
+
+    def _communicate(request, number_of_bytes_to_read):
+        exchange[0] = len(request)
+        # while detecting the BMS, the reply is not awaited beyond the detection deadline
+        timeout = instrument.serial.timeout
+        remaining = get_detection_remaining(timeout)
+        if remaining != timeout:
+            instrument.serial.timeout = remaining
+        with get_serial_port_lock(port):
+            # minimalmodbus opens its own connection and changes the line settings (e.g. the
+            # parity), therefore the shared port is closed and reopened with its settings later
+            close_serial_port(port)
+            try:
+                answer = communicate(request, number_of_bytes_to_read)
+            finally:
+                if remaining != timeout:
+                    instrument.serial.timeout = timeout
+        exchange[1] = len(answer)
+        return answer
+
+    def _perform_command(functioncode, payload_to_slave):
+        # slave address, function code and register address
+        command = bytes((instrument.address, functioncode)) + payload_to_slave[
+            :2
+        ].encode("latin1")
+        exchange[0] = exchange[1] = 0
+        start = monotonic()
+        try:
+            payload = perform_command(functioncode, payload_to_slave)
+        except Exception as e:
+            # the exceptions of minimalmodbus are checked by name, since it's an optional module.
+            # The reply is validated after _communicate(), therefore checksum errors are raised here
+            name = type(e).__name__
+            record_transport(
+                port,
+                command,
+                exchange[0],
+                exchange[1],
+                monotonic() - start,
+                name == "NoResponseError",
+            )
+            # only the beginning of the message is checked, since it contains the raw reply
+            if name == "InvalidResponseError" and str(e).startswith("Checksum error"):
+                record_transport_event(port, command, "checksum_errors")
+            raise
+
+        record_transport(port, command, exchange[0], exchange[1], monotonic() - start)
+        return payload
+
+    instrument._communicate = _communicate
+    instrument._perform_command = _perform_command
+    return instrument
+
+
 def read_serial_data(
     command, port, baud, length_pos, length_check, length_fixed=None, length_size=None
 ):
     try:
-        with serial.Serial(port, baudrate=baud, timeout=0.1) as ser:
+        with serial_port_session(port, baud) as ser:
             return read_serialport_data(
                 ser, command, length_pos, length_check, length_fixed, length_size
             )
@@ -428,23 +958,60 @@ def read_serial_data(
         return False
 
 
-# Open the serial port
-# Return variable for the openned port
-def open_serial_port(port, baud):
-    ser = None
-    tries = 3
-    while tries > 0:
-        try:
-            ser = serial.Serial(port, baudrate=baud, timeout=0.1)
-            tries = 0
-        except serial.SerialException as e:
-            logger.error(e)
-            tries -= 1
+# Read data from previously opened serial port
+# A SerialException is passed on to the caller, which decides if the port has to be reopened
+# Time to wait for the first bytes of a reply
+SERIAL_REPLY_TIMEOUT = 0.25
+# Additional time allowed on top of the wire time of the remaining frame bytes
+SERIAL_FRAME_MARGIN = 0.1
+
+
+def serial_wire_time(ser: serial.Serial, size: int) -> float:
+    """
+    Returns the time needed to transfer size bytes at the current baud rate (10 bits per byte)
+    """
+    return size * 10 / ser.baudrate if ser.baudrate else 0
+
+
+def read_serial_bytes(
+    ser: serial.Serial, size: int, deadline: float, greedy: bool = False
+) -> bytearray:
+    """
+    Reads size bytes from the serial port and returns as soon as they are received.
+    Waits on the file descriptor of the port instead of polling, until the deadline
+    (time.monotonic()) is reached. If greedy is set, also bytes beyond size that are
+    already waiting are returned.
+    Returns the received bytes, which are less than size on timeout.
+    """
+    deadline = monotonic() + get_detection_remaining(deadline - monotonic())
+    data = bytearray()
+    try:
+        fd = ser.fileno()
+    except (AttributeError, io.UnsupportedOperation, serial.SerialException):
+        fd = None
+
+    while len(data) < size:
+        waiting = ser.in_waiting
+        if waiting:
+            needed = size - len(data)
+            data += ser.read(waiting if greedy else min(waiting, needed))
+            continue
 
-    return ser
+        remaining = deadline - monotonic()
+        if remaining <= 0:
+            break
+        if fd is not None:
+            select.select([fd], [], [], remaining)
+        else:
+            # ports without a file descriptor (e.g. network ports) use a blocking read
+            timeout = ser.timeout
+            ser.timeout = remaining
+            data += ser.read(1)
+            ser.timeout = timeout
+
+    return data
 
 
-# Read data from previously opened serial port
 def read_serialport_data(
     ser: serial.Serial,
     command,
@@ -453,68 +1020,78 @@ def read_serialport_data(
     length_fixed=None,
     length_size=None,
 ):
-    try:
-        ser.flushOutput()
-        ser.flushInput()
-        ser.write(command)
-
-        length_byte_size = 1
-        if length_size is not None:
-            if length_size.upper() == "H":
-                length_byte_size = 2
-            elif length_size.upper() == "I" or length_size.upper() == "L":
-                length_byte_size = 4
-
-        count = 0
-        toread = ser.inWaiting()
-
-        while toread < (length_pos + length_byte_size):
-            sleep(0.005)
-            toread = ser.inWaiting()
-            count += 1
-            if count > 50:
-                logger.error(">>> ERROR: No reply - returning")
-                return False
-
-        # logger.info('serial data toread ' + str(toread))
-        res = ser.read(toread)
-        if length_fixed is not None:
-            length = length_fixed
-        else:
-            if len(res) < (length_pos + length_byte_size):
-                logger.error(
-                    ">>> ERROR: No reply - returning [len:" + str(len(res)) + "]"
-                )
-                return False
-            length_size = length_size if length_size is not None else "B"
-            length = unpack_from(">" + length_size, res, length_pos)[0]
-
-        # logger.info('serial data length ' + str(length))
-
-        count = 0
-        data = bytearray(res)
-        while len(data) <= length + length_check:
-            res = ser.read(length + length_check)
-            data.extend(res)
-            # logger.info('serial data length ' + str(len(data)))
-            sleep(0.005)
-            count += 1
-            if count > 150:
-                logger.error(
-                    ">>> ERROR: No reply - returning [len:"
-                    + str(len(data))
-                    + "/"
-                    + str(length + length_check)
-                    + "]"
-                )
-                return False
-
-        return data
+    start = monotonic()
+    data = read_serialport_frame(
+        ser, command, length_pos, length_check, length_fixed, length_size
+    )
+    record_transport(
+        ser.port,
+        command,
+        len(command),
+        len(data) if data is not False else 0,
+        monotonic() - start,
+        data is False,
+    )
+    return data
 
-    except serial.SerialException as e:
-        logger.error(e)
+
+def read_serialport_frame(
+    ser: serial.Serial,
+    command,
+    length_pos,
+    length_check,
+    length_fixed=None,
+    length_size=None,
+):
+    ser.flushOutput()
+    ser.flushInput()
+    ser.write(command)
+
+    length_byte_size = 1
+    if length_size is not None:
+        if length_size.upper() == "H":
+            length_byte_size = 2
+        elif length_size.upper() == "I" or length_size.upper() == "L":
+            length_byte_size = 4
+
+    # wait for the header including the length field, take everything that's already there
+    header_size = length_pos + length_byte_size
+    deadline = monotonic() + SERIAL_REPLY_TIMEOUT + serial_wire_time(ser, len(command))
+    data = read_serial_bytes(ser, header_size, deadline, greedy=True)
+    if len(data) < header_size:
+        logger.error(">>> ERROR: No reply - returning [len:" + str(len(data)) + "]")
         return False
 
+    if length_fixed is not None:
+        length = length_fixed
+    else:
+        length_size = length_size if length_size is not None else "B"
+        length = unpack_from(">" + length_size, data, length_pos)[0]
+
+    # logger.info('serial data length ' + str(length))
+
+    # the frame is complete with length + length_check + 1 bytes
+    frame_size = length + length_check + 1
+    if len(data) < frame_size:
+        deadline = (
+            monotonic()
+            + serial_wire_time(ser, frame_size - len(data))
+            + SERIAL_FRAME_MARGIN
+        )
+        data += read_serial_bytes(ser, frame_size - len(data), deadline)
+
+        if len(data) < frame_size:
+            logger.error(
+                ">>> ERROR: No reply - returning [len:"
+                + str(len(data))
+                + "/"
+                + str(length + length_check)
+                + "]"
+            )
+            return False
+
+    return data
+
 
 locals_copy = locals().copy()
 